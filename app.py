@@ -1,29 +1,43 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, make_response
 from datetime import datetime, timedelta
 import json
 import time
+import hashlib
+import copy
+import tempfile
+import sqlite3
+import click
 import re
 import threading
 import os
+import traceback
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import atexit
 import urllib.parse
 import webbrowser
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait, Select
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import StaleElementReferenceException, TimeoutException
-from webdriver_manager.chrome import ChromeDriverManager
+import shutil
+from html.parser import HTMLParser
+from contextlib import contextmanager
+# Only Selenium's exceptions load eagerly (they are cheap and needed by except clauses); the WebDriver,
+# webdriver_manager, requests and Google client imports happen inside the functions that use them, so
+# the web routes start without paying for the automation stack.
+from selenium.common.exceptions import (SessionNotCreatedException, StaleElementReferenceException, TimeoutException,
+                                        WebDriverException)
 import pickle
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locks, so run a single worker there
+    fcntl = None
 
 app = Flask(__name__, static_folder='static')
 
 # Global Constants
 SCOPES = ['https://www.googleapis.com/auth/calendar.events']
+CALENDAR_TOKEN_FILE = 'token.pickle'
+CALENDAR_ID = 'primary'
+CALENDAR_BATCH_SIZE = 50  # Maximum calls per Calendar API batch request
 DAY_OF_WEEK_MAPPING = {
     "Monday": 0,
     "Tuesday": 1,
@@ -34,9 +48,100 @@ DAY_OF_WEEK_MAPPING = {
     "Sunday": 6
 }
 TIMEZONE = 'Australia/Perth'
+INSTAGRAM_BASE_URL = os.environ.get('INSTAGRAM_BASE_URL', "https://www.instagram.com")
+COOKIE_SITES = {
+    "google": ("https://www.google.com", "google_cookies.json"),
+    "paypal": ("https://www.paypal.com.au", "paypal_cookies.json"),
+    "pba": ("https://pba.yepbooking.com.au", "pba_cookies.json"),
+    "instagram": (INSTAGRAM_BASE_URL + "/", "instagram_cookies.json"),
+}
+DRIVER_POOL_SIZE = int(os.environ.get('DRIVER_POOL_SIZE', 3))
+DRIVER_MAX_AGE = int(os.environ.get('DRIVER_MAX_AGE', 30 * 60))  # Seconds before a session is recycled
+DRIVER_POOL_PREWARM = int(os.environ.get('DRIVER_POOL_PREWARM', 0))
+CHROMEDRIVER_PATH = os.environ.get('CHROMEDRIVER_PATH')  # Skips resolution entirely when set
+CHROMEDRIVER_CACHE = os.environ.get('CHROMEDRIVER_CACHE', '.chromedriver_path')  # Remembers the resolved path
+LOCK_DIR = os.environ.get('LOCK_DIR', '.locks')  # Lock files shared by the WSGI worker processes
+BROWSER_PROFILE_DIR = os.environ.get('BROWSER_PROFILE_DIR', 'browser_profiles')  # Empty disables persistent profiles
+BROWSER_PROFILE_SLOTS = int(os.environ.get('BROWSER_PROFILE_SLOTS', 8))  # Profiles shared by all worker processes
+# Cookie that proves each site's login; None means any saved cookie for the site's domain
+LOGIN_COOKIES = {
+    "google": "SID",
+    "paypal": None,
+    "pba": "PHPSESSID",
+    "instagram": "sessionid",
+}
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+JOB_QUEUE_LIMIT = int(os.environ.get('JOB_QUEUE_LIMIT', 50))  # Queued or running jobs before new ones are rejected
+JOB_HISTORY_LIMIT = 200  # Finished jobs kept for /jobs
+JOB_TYPE_LIMITS = {
+    'buy-credits': 1,
+    'book-court': 2,
+    'book-week': 1,
+    'message-student': 2,
+    'message-week': 1,
+    'add-to-calendar': 4,
+    'sync-calendar': 1,
+}
+PBA_BASE_URL = os.environ.get('PBA_BASE_URL', "https://pba.yepbooking.com.au")
+PBA_CREDIT_LIST_PATH = os.environ.get('PBA_CREDIT_LIST_PATH', "/user.php?tab=credit-list")
+PBA_COURTS = (("PBA Canningvale", "Hebat Court"), ("PBA Canningvale", "Super Court"), ("PBA Malaga", None))
+# Schema request each booking tab makes, copied from the browser's network panel, as a JSON object keyed
+# "Location" or "Location/Court Type", e.g. {"PBA Malaga": "/...?day={date}"} with {date} as YYYY-MM-DD.
+# /availability answers "not configured" until it is set.
+PBA_SCHEMA_PATHS = {(name.partition('/')[0], name.partition('/')[2] or None): path
+                    for name, path in json.loads(os.environ.get('PBA_SCHEMA_PATHS') or '{}').items()}
+PBA_HTTP_TIMEOUT = 10
+AVAILABILITY_TTL = int(os.environ.get('AVAILABILITY_TTL', 5 * 60))  # Seconds a fetched schema stays fresh
+CREDIT_PURCHASE_PARALLELISM = int(os.environ.get('CREDIT_PURCHASE_PARALLELISM', 2))
+CREDIT_PURCHASE_TIMEOUT = int(os.environ.get('CREDIT_PURCHASE_TIMEOUT', 180))  # Seconds per purchase attempt
+CREDIT_PURCHASE_RETRIES = 2
+CREDIT_PURCHASE_BACKOFF = 2  # Seconds before the first retry, doubled for each one after
+HISTORY_DB = os.environ.get('HISTORY_DB', 'history.db')
+# Hourly court rates per (location, courtType), mirroring ratesData in static/js/app.js
+COURT_RATES = {
+    ("PBA Malaga", None): {'weekday': [(0, 17 * 60, 19), (17 * 60, 24 * 60, 29)], 'weekend': [(0, 24 * 60, 29)]},
+    ("PBA Canningvale", "Hebat Court"): {'weekday': [(0, 17 * 60, 16), (17 * 60, 24 * 60, 26)],
+                                         'weekend': [(0, 24 * 60, 26)]},
+    ("PBA Canningvale", "Super Court"): {'weekday': [(0, 17 * 60, 19), (17 * 60, 24 * 60, 29)],
+                                         'weekend': [(0, 24 * 60, 29)]},
+    ("Kingsway", None): {'weekday': [(0, 24 * 60, 19)], 'weekend': [(0, 24 * 60, 29)]},
+}
+MESSAGE_REVIEW_TIMEOUT = int(os.environ.get('MESSAGE_REVIEW_TIMEOUT', 120))  # Seconds to wait for a manual send
+WAIT_POLL_INTERVAL = float(os.environ.get('WAIT_POLL_INTERVAL', 0.1))  # Seconds between condition checks
+WAIT_MARGIN = float(os.environ.get('WAIT_MARGIN', 2.0))  # Learned timeout = p95 of past durations x margin
+WAIT_MIN_SAMPLES = 20  # Successful waits needed before a step's timeout is learned
+WAIT_HISTORY = 200  # Recent durations kept per step
+WAIT_DEFAULT_TIMEOUT = float(os.environ.get('WAIT_DEFAULT_TIMEOUT', 20))  # Until a step has enough samples
+WAIT_MIN_TIMEOUT = 2
+WAIT_MAX_TIMEOUT = 30
+WAIT_OPTIONAL_TIMEOUT = 3  # For elements that are often legitimately absent, like dismissable dialogs
+STEP_LOG = os.environ.get('STEP_LOG', 'steps.jsonl')  # JSON lines log of every traced step; empty disables it
+STEP_LOG_MAX_BYTES = int(os.environ.get('STEP_LOG_MAX_BYTES', 10 * 1024 * 1024))  # Rotate past this size; 0 never
+STEP_LOG_BACKUPS = int(os.environ.get('STEP_LOG_BACKUPS', 3))  # Rotated files kept as steps.jsonl.1, .2, ...
+METRIC_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)  # Histogram bucket bounds in seconds
 
 
 # Helper Functions
+def parse_week(value):
+    """Check that value is a YYYY-MM-DD Monday and return it; raises ValueError otherwise."""
+    try:
+        week = datetime.strptime(value, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        week = None
+    # Weeks are stored and compared as strings, so only the zero-padded form is accepted
+    if week is None or week.strftime("%Y-%m-%d") != value:
+        raise ValueError(f"weekStarting must be a YYYY-MM-DD date, not {value!r}.")
+    if week.weekday() != 0:
+        # Session dates, costs and template schedules all count days from the week's Monday
+        raise ValueError(f"weekStarting must be a Monday; {value} is a {week:%A}.")
+    return value
+
+
+def get_booking_date(starting_week, day_of_week):
+    starting_date = datetime.strptime(starting_week, "%Y-%m-%d")
+    return starting_date + timedelta(days=DAY_OF_WEEK_MAPPING[day_of_week])
+
+
 def load_json(file_path):
     try:
         with open(file_path, 'r') as f:
@@ -47,31 +152,1166 @@ def load_json(file_path):
 
 
 def save_json(file_path, data):
+    # Write to a temp file in the same directory and rename it so readers never see a partial file
+    temp_path = None
     try:
-        with open(file_path, 'w') as f:
+        directory = os.path.dirname(os.path.abspath(file_path))
+        with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as f:
+            temp_path = f.name
             json.dump(data, f, indent=4)
+        os.replace(temp_path, file_path)
         print(f"Configuration saved to {file_path}")
         return True
     except Exception as e:
         print(f"Error saving {file_path}: {e}")
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
         return False
 
 
+class ProcessLock:
+    """Exclusive lock on a file in LOCK_DIR, held across threads and worker processes on this host.
+
+    Falls back to a plain thread lock where fcntl is unavailable.
+    """
+
+    _thread_locks = {}
+
+    def __init__(self, name):
+        self.path = os.path.join(LOCK_DIR, f"{name}.lock")
+        self._file = None
+        self._thread_lock = self._thread_locks.setdefault(self.path, threading.Lock())
+
+    def acquire(self, blocking=True):
+        if not self._thread_lock.acquire(blocking):
+            return False
+        if fcntl is None:
+            return True
+        try:
+            os.makedirs(LOCK_DIR, exist_ok=True)
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            return True
+        except OSError:
+            if self._file:
+                self._file.close()
+                self._file = None
+            self._thread_lock.release()
+            if blocking:
+                raise
+            return False
+
+    def release(self):
+        if self._file:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class JsonStore:
+    """Read-only, in-memory copy of a JSON file, reloaded when the file's mtime changes.
+
+    on_reload is called with the freshly loaded data, e.g. to mirror it into the history database.
+    Data returned by read() is shared; use snapshot() for a copy that can be changed.
+    """
+
+    def __init__(self, path, on_reload=None):
+        self.path = path
+        self.on_reload = on_reload
+        self._lock = threading.RLock()
+        self._data = None
+        self._etag = None
+        self._mtime = None
+
+    @staticmethod
+    def _compute_etag(data):
+        return hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _reload_if_changed(self):
+        mtime = self._file_mtime()
+        if mtime is not None and mtime == self._mtime:
+            return
+        self._data = load_json(self.path) if mtime is not None else None
+        self._mtime = mtime
+        self._etag = self._compute_etag(self._data) if self._data is not None else None
+        if self._data is not None and self.on_reload:
+            try:
+                self.on_reload(self._data)
+            except Exception as e:
+                print(f"Error handling reload of {self.path}: {e}")
+
+    def read(self):
+        """Return (data, etag); data is None if the file is missing or invalid."""
+        with self._lock:
+            self._reload_if_changed()
+            return self._data, self._etag
+
+    def snapshot(self):
+        with self._lock:
+            self._reload_if_changed()
+            return copy.deepcopy(self._data)
+
+
+SESSION_FIELDS = ('studentName', 'dayOfWeek', 'courtLocation', 'sessionStart', 'sessionEnd', 'courtType',
+                  'statusMessaged', 'statusBooked')
+
+
+BOOKING_FIELDS = ('dayOfWeek', 'courtLocation', 'courtType', 'sessionStart', 'sessionEnd')
+
+
+class VersionConflict(Exception):
+    def __init__(self, message, current=None):
+        super().__init__(message)
+        self.current = current
+
+
+def new_session_id():
+    return uuid.uuid4().hex[:12]
+
+
+def normalize_config(config):
+    """Give the config and every session a stable id and version; returns True if anything was added."""
+    if not isinstance(config, dict):
+        return False
+    changed = False
+    if not isinstance(config.get('version'), int):
+        config['version'] = 1
+        changed = True
+    seen = set()
+    for session in config.setdefault('sessions', []):
+        if not session.get('id') or session['id'] in seen:
+            session['id'] = new_session_id()
+            changed = True
+        seen.add(session['id'])
+        if not isinstance(session.get('version'), int):
+            session['version'] = 1
+            changed = True
+    return changed
+
+
+def touch_session(config, session):
+    session['version'] = session.get('version', 0) + 1
+    config['version'] = config.get('version', 0) + 1
+
+
+def find_session(config, session_id):
+    return next((session for session in config.get('sessions', []) if session.get('id') == session_id), None)
+
+
+def check_version(expected, current, what):
+    if expected is None:
+        return
+    try:
+        expected = int(expected)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {what} version.")
+    if expected != current:
+        raise VersionConflict(f"The {what} was changed elsewhere (version {current}, expected {expected}).")
+
+
+def session_cost(court_location, court_type, day_of_week, session_start, session_end):
+    """Court cost of a session in dollars, or None if the location or times are unknown."""
+    rates = COURT_RATES.get((court_location, court_type or None))
+    if rates is None and court_location == "PBA Canningvale":
+        rates = COURT_RATES[(court_location, "Super Court")]
+    rates = rates or COURT_RATES.get((court_location, None))
+    if not rates or day_of_week not in DAY_OF_WEEK_MAPPING:
+        return None
+    try:
+        start = datetime.strptime(session_start, '%H:%M')
+        end = datetime.strptime(session_end, '%H:%M')
+    except (TypeError, ValueError):
+        return None
+    periods = rates['weekend' if DAY_OF_WEEK_MAPPING[day_of_week] >= 5 else 'weekday']
+    start_minutes, end_minutes = start.hour * 60 + start.minute, end.hour * 60 + end.minute
+    cost = 0.0
+    for period_start, period_end, rate in periods:
+        overlap = min(end_minutes, period_end) - max(start_minutes, period_start)
+        if overlap > 0:
+            cost += rate * overlap / 60
+    return round(cost, 2)
+
+
+# History Store
+class HistoryStore:
+    """SQLite storage for every week's sessions, students and booking/messaging outcomes.
+
+    The current week is exposed through a read/snapshot/update/write interface in the shape
+    config.json always had, so /config and the session endpoints work unchanged.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS weeks (
+            week_starting TEXT PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS students (
+            name TEXT PRIMARY KEY,
+            contact_preference TEXT,
+            contact_info TEXT
+        );
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            week_starting TEXT NOT NULL REFERENCES weeks(week_starting) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            version INTEGER NOT NULL DEFAULT 1,
+            student_name TEXT NOT NULL DEFAULT '',
+            day_of_week TEXT NOT NULL DEFAULT '',
+            session_date TEXT,
+            court_location TEXT NOT NULL DEFAULT '',
+            court_type TEXT NOT NULL DEFAULT '',
+            session_start TEXT NOT NULL DEFAULT '',
+            session_end TEXT NOT NULL DEFAULT '',
+            status_messaged INTEGER NOT NULL DEFAULT 0,
+            status_booked INTEGER NOT NULL DEFAULT 0,
+            cost REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_week ON sessions(week_starting, position);
+        CREATE INDEX IF NOT EXISTS idx_sessions_student ON sessions(student_name, session_date);
+        CREATE INDEX IF NOT EXISTS idx_sessions_location ON sessions(court_location, session_date);
+        CREATE TABLE IF NOT EXISTS outcomes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            week_starting TEXT,
+            student_name TEXT,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            detail TEXT,
+            created_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_outcomes_session ON outcomes(session_id, created_at);
+        CREATE INDEX IF NOT EXISTS idx_outcomes_student ON outcomes(student_name, created_at);
+        CREATE TABLE IF NOT EXISTS terms (
+            name TEXT PRIMARY KEY,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS templates (
+            id TEXT PRIMARY KEY,
+            student_name TEXT NOT NULL,
+            day_of_week TEXT NOT NULL,
+            court_location TEXT NOT NULL,
+            court_type TEXT NOT NULL DEFAULT '',
+            session_start TEXT NOT NULL,
+            session_end TEXT NOT NULL,
+            frequency TEXT NOT NULL DEFAULT 'weekly',
+            anchor_week TEXT NOT NULL,
+            start_date TEXT,
+            end_date TEXT,
+            term TEXT REFERENCES terms(name) ON DELETE SET NULL,
+            exceptions TEXT NOT NULL DEFAULT '[]',
+            active INTEGER NOT NULL DEFAULT 1
+        );
+        CREATE TABLE IF NOT EXISTS step_timings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            step TEXT NOT NULL,
+            seconds REAL NOT NULL,
+            ok INTEGER NOT NULL,
+            recorded_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_step_timings_step ON step_timings(step, id);
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            type TEXT NOT NULL,
+            state TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs(created_at);
+        CREATE TABLE IF NOT EXISTS availability_invalidations (
+            court_location TEXT NOT NULL,
+            court_type TEXT NOT NULL DEFAULT '',
+            date TEXT NOT NULL,
+            invalidated_at REAL NOT NULL,
+            PRIMARY KEY (court_location, court_type, date)
+        );
+    """
+    COLUMNS = {
+        'studentName': 'student_name',
+        'dayOfWeek': 'day_of_week',
+        'courtLocation': 'court_location',
+        'courtType': 'court_type',
+        'sessionStart': 'session_start',
+        'sessionEnd': 'session_end',
+        'statusMessaged': 'status_messaged',
+        'statusBooked': 'status_booked',
+    }
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self.lock = threading.RLock()
+        self._local = threading.local()
+        self._cache = None
+        conn = self._connection()
+        conn.executescript(self.SCHEMA)
+        # Part of every ETag, so a recreated database never answers 304 to a tag from the old one
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('store_id', ?)", (uuid.uuid4().hex[:8],))
+        self._store_id = self._meta(conn, 'store_id')
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads, so each thread opens its own
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _meta(self, conn, key):
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else None
+
+    @staticmethod
+    def _set_meta(conn, key, value):
+        conn.execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                     (key, str(value)))
+
+    def is_empty(self):
+        return self._meta(self._connection(), 'current_week') is None
+
+    @classmethod
+    def _session_from_row(cls, row):
+        session = {field: row[column] for field, column in cls.COLUMNS.items()}
+        session['statusMessaged'] = bool(session['statusMessaged'])
+        session['statusBooked'] = bool(session['statusBooked'])
+        session['id'] = row['id']
+        session['version'] = row['version']
+        return session
+
+    # Current week, in the config.json shape
+    def _load(self, conn):
+        """The current week as stored on conn, or {} if nothing has been stored yet."""
+        week = self._meta(conn, 'current_week')
+        if week is None:
+            return {}
+        rows = conn.execute("SELECT * FROM sessions WHERE week_starting = ? ORDER BY position", (week,)).fetchall()
+        return {
+            'weekStarting': week,
+            'sessions': [self._session_from_row(row) for row in rows],
+            'version': int(self._meta(conn, 'config_version')),
+        }
+
+    def _etag(self, revision):
+        return f"{self._store_id}-{revision}"
+
+    def _bump_revision(self, conn, week, version):
+        # Every change to the current week gets a new revision from the database, so two worker processes
+        # can't both produce "version 6" with different contents; read()'s cache and the ETag key on it
+        revision = int(self._meta(conn, 'revision') or 0) + 1
+        self._set_meta(conn, 'current_week', week)
+        self._set_meta(conn, 'config_version', version)
+        self._set_meta(conn, 'revision', revision)
+        return revision
+
+    def read(self):
+        """Return (config, etag) for the current week; config is None if nothing has been stored yet."""
+        conn = self._connection()
+        with self.lock:
+            # A read transaction, so the revision and the rows come from the same commit
+            conn.execute("BEGIN")
+            try:
+                revision = self._meta(conn, 'revision') or '0'
+                if self._cache and self._cache[0] == revision:
+                    return self._cache[1], self._cache[2]
+                config = self._load(conn) or None
+            finally:
+                conn.execute("COMMIT")
+            etag = self._etag(revision) if config is not None else None
+            self._cache = (revision, config, etag)
+            return config, etag
+
+    def snapshot(self):
+        return copy.deepcopy(self.read()[0])
+
+    def _write(self, conn, config):
+        normalize_config(config)
+        week = parse_week(config['weekStarting'])
+        conn.execute("INSERT OR IGNORE INTO weeks (week_starting) VALUES (?)", (week,))
+        kept = []
+        for position, session in enumerate(config['sessions']):
+            owner = conn.execute("SELECT week_starting FROM sessions WHERE id = ?", (session['id'],)).fetchone()
+            if owner and owner['week_starting'] != week:
+                # Session ids are global, so a session carried into another week becomes a new one
+                session['id'] = new_session_id()
+            self._upsert_session(conn, week, position, session)
+            kept.append(session['id'])
+        conn.execute(f"DELETE FROM sessions WHERE week_starting = ? AND id NOT IN ({','.join('?' * len(kept))})",
+                     (week, *kept))
+        return self._bump_revision(conn, week, config['version'])
+
+    def write(self, config):
+        with self.lock, self._transaction() as conn:
+            revision = self._write(conn, config)
+        self._cache = None
+        return self._etag(revision)
+
+    def _upsert_session(self, conn, week, position, session):
+        values = {column: session.get(field, '') for field, column in self.COLUMNS.items()}
+        values['status_messaged'] = int(bool(session.get('statusMessaged')))
+        values['status_booked'] = int(bool(session.get('statusBooked')))
+        try:
+            session_date = get_booking_date(week, session.get('dayOfWeek')).strftime("%Y-%m-%d")
+        except (KeyError, ValueError, TypeError):
+            session_date = None
+        columns = ['id', 'week_starting', 'position', 'version', 'session_date', 'cost', *values]
+        params = [session['id'], week, position, session['version'], session_date,
+                  session_cost(session.get('courtLocation'), session.get('courtType'), session.get('dayOfWeek'),
+                               session.get('sessionStart'), session.get('sessionEnd')),
+                  *values.values()]
+        conn.execute(
+            f"INSERT INTO sessions ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT(id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in columns[1:])}",
+            params)
+
+    def update(self, func):
+        """Apply func to the current week ({} if none) and save it; returns (func's return value, etag).
+
+        The read, func's checks and the write share one BEGIN IMMEDIATE transaction, so another worker
+        process can't write in between and have its changes overwritten.
+        """
+        with self.lock, self._transaction() as conn:
+            config = self._load(conn)
+            original = copy.deepcopy(config)
+            result = func(config)
+            revision = self._write(conn, config) if config and config != original else None
+        self._cache = None
+        return result, self._etag(revision) if revision is not None else self.read()[1]
+
+    def switch_week(self, week, expected_version=None):
+        """Make week current. A week that isn't stored yet is built from the active templates, or when there
+        are none, copied from the current week with statuses cleared."""
+        parse_week(week)
+        with self.lock, self._transaction() as conn:
+            current_week = self._meta(conn, 'current_week')
+            version = int(self._meta(conn, 'config_version') or 0)
+            if current_week is not None:
+                check_version(expected_version, version, 'configuration')
+            # The weeks table, not its sessions, says whether a week exists: generated weeks can be empty
+            if not conn.execute("SELECT 1 FROM weeks WHERE week_starting = ?", (week,)).fetchone():
+                conn.execute("INSERT INTO weeks (week_starting) VALUES (?)", (week,))
+                if conn.execute("SELECT 1 FROM templates WHERE active = 1 LIMIT 1").fetchone():
+                    sessions = self.sessions_from_templates(week)
+                else:
+                    rows = conn.execute("SELECT * FROM sessions WHERE week_starting = ? ORDER BY position",
+                                        (current_week,)).fetchall()
+                    sessions = [dict(self._session_from_row(row), id=new_session_id(), version=1,
+                                     statusMessaged=False, statusBooked=False) for row in rows]
+                for position, session in enumerate(sessions):
+                    self._upsert_session(conn, week, position, session)
+            self._bump_revision(conn, week, version + 1)
+        self._cache = None
+        return version + 1
+
+    # History
+    def sync_students(self, students):
+        """Upsert students.json into the students table; students removed from the file are kept as history."""
+        if not isinstance(students, list):
+            return
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO students (name, contact_preference, contact_info) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET contact_preference = excluded.contact_preference, "
+                "contact_info = excluded.contact_info",
+                [(s.get('name'), s.get('contactPreference'), s.get('contactInfo')) for s in students if s.get('name')])
+
+    def record_outcome(self, session_id, kind, status, detail=None):
+        conn = self._connection()
+        row = conn.execute("SELECT week_starting, student_name FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        conn.execute(
+            "INSERT INTO outcomes (session_id, week_starting, student_name, kind, status, detail, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (session_id, row['week_starting'] if row else None, row['student_name'] if row else None,
+             kind, status, None if detail is None else str(detail), datetime.now().isoformat(timespec='seconds')))
+
+    def record_step_timing(self, step, seconds, ok):
+        self._connection().execute(
+            "INSERT INTO step_timings (step, seconds, ok, recorded_at) VALUES (?, ?, ?, ?)",
+            (step, seconds, int(ok), datetime.now().isoformat(timespec='seconds')))
+
+    def save_job(self, job):
+        """Store a job's to_dict() so every worker process can report on it."""
+        self._connection().execute(
+            "INSERT OR REPLACE INTO jobs (id, type, state, created_at, data) VALUES (?, ?, ?, ?, ?)",
+            (job['id'], job['type'], job['state'], job['createdAt'], json.dumps(job, default=str)))
+
+    def get_job(self, job_id):
+        row = self._connection().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def list_jobs(self, state=None, job_type=None, limit=JOB_HISTORY_LIMIT):
+        """Stored jobs, newest first; state may be one state or a tuple of them, and limit None means all."""
+        states = (state,) if isinstance(state, str) else tuple(state or ())
+        clauses, params = [], []
+        if states:
+            clauses.append(f"state IN ({', '.join('?' * len(states))})")
+            params.extend(states)
+        if job_type:
+            clauses.append('type = ?')
+            params.append(job_type)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self._connection().execute(
+            f"SELECT data FROM jobs {where} ORDER BY created_at DESC LIMIT ?",
+            (*params, -1 if limit is None else limit)).fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    def prune_jobs(self, keep=JOB_HISTORY_LIMIT):
+        self._connection().execute(
+            "DELETE FROM jobs WHERE state IN ('succeeded', 'failed') AND id NOT IN "
+            "(SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?)", (keep,))
+
+    def invalidate_availability(self, court_location='*', court_type=None, date='*', prune_before=None):
+        """Stamp a court and date (by default every court and date) as changed, for every worker's cache.
+
+        Stamps from before prune_before can no longer outdate a cached grid, so they are dropped.
+        """
+        with self._transaction() as conn:
+            if prune_before is not None:
+                conn.execute("DELETE FROM availability_invalidations WHERE invalidated_at < ?", (prune_before,))
+            conn.execute(
+                "INSERT INTO availability_invalidations (court_location, court_type, date, invalidated_at) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT(court_location, court_type, date) "
+                "DO UPDATE SET invalidated_at = excluded.invalidated_at",
+                (court_location, court_type or '', date, time.time()))
+
+    def availability_invalidated_at(self, court_location, court_type, date):
+        """When the court and date were last invalidated (directly or all at once), as a time.time() value."""
+        row = self._connection().execute(
+            "SELECT MAX(invalidated_at) AS stamp FROM availability_invalidations WHERE "
+            "(court_location = ? AND court_type = ? AND date = ?) OR (court_location = '*' AND date = '*')",
+            (court_location, court_type or '', date)).fetchone()
+        return row['stamp'] or 0.0
+
+    def recent_step_timings(self, per_step=WAIT_HISTORY):
+        """The newest timings of every step as (step, seconds, ok), oldest first; older rows are pruned."""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM step_timings WHERE id IN (SELECT id FROM (SELECT id, ROW_NUMBER() OVER "
+                         "(PARTITION BY step ORDER BY id DESC) AS n FROM step_timings) WHERE n > ?)", (per_step,))
+            rows = conn.execute("SELECT step, seconds, ok FROM step_timings ORDER BY id").fetchall()
+        return [(row['step'], row['seconds'], bool(row['ok'])) for row in rows]
+
+    def query_sessions(self, student=None, location=None, start=None, end=None):
+        clauses, params = [], []
+        for column, value in (('student_name = ?', student), ('court_location = ?', location),
+                              ('session_date >= ?', start), ('session_date <= ?', end)):
+            if value:
+                clauses.append(column)
+                params.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self._connection().execute(
+            f"SELECT * FROM sessions {where} ORDER BY session_date, session_start", params).fetchall()
+        return [dict(self._session_from_row(row), weekStarting=row['week_starting'], date=row['session_date'],
+                     cost=row['cost']) for row in rows]
+
+    def cost_per_student_month(self, start=None, end=None):
+        clauses, params = ["session_date IS NOT NULL"], []
+        if start:
+            clauses.append("session_date >= ?")
+            params.append(start)
+        if end:
+            clauses.append("session_date <= ?")
+            params.append(end)
+        rows = self._connection().execute(
+            f"SELECT student_name, substr(session_date, 1, 7) AS month, COUNT(*) AS sessions, "
+            f"ROUND(SUM(COALESCE(cost, 0)), 2) AS cost FROM sessions WHERE {' AND '.join(clauses)} "
+            f"GROUP BY student_name, month ORDER BY month, student_name", params).fetchall()
+        return [{'studentName': row['student_name'], 'month': row['month'], 'sessions': row['sessions'],
+                 'cost': row['cost']} for row in rows]
+
+    # Recurring templates
+    TEMPLATE_COLUMNS = {
+        'studentName': 'student_name',
+        'dayOfWeek': 'day_of_week',
+        'courtLocation': 'court_location',
+        'courtType': 'court_type',
+        'sessionStart': 'session_start',
+        'sessionEnd': 'session_end',
+        'frequency': 'frequency',
+        'anchorWeek': 'anchor_week',
+        'startDate': 'start_date',
+        'endDate': 'end_date',
+        'term': 'term',
+        'exceptions': 'exceptions',
+        'active': 'active',
+    }
+
+    @classmethod
+    def _template_from_row(cls, row):
+        template = {field: row[column] for field, column in cls.TEMPLATE_COLUMNS.items()}
+        template['exceptions'] = json.loads(template['exceptions'])
+        template['active'] = bool(template['active'])
+        template['id'] = row['id']
+        return template
+
+    def list_templates(self):
+        rows = self._connection().execute(
+            "SELECT * FROM templates ORDER BY student_name, day_of_week, session_start").fetchall()
+        return [self._template_from_row(row) for row in rows]
+
+    def get_template(self, template_id):
+        row = self._connection().execute("SELECT * FROM templates WHERE id = ?", (template_id,)).fetchone()
+        return self._template_from_row(row) if row else None
+
+    def save_template(self, template):
+        """Insert or replace a validated template and return it."""
+        template = dict(template, id=template.get('id') or new_session_id())
+        values = {column: template.get(field) for field, column in self.TEMPLATE_COLUMNS.items()}
+        values['exceptions'] = json.dumps(sorted(template.get('exceptions') or []))
+        values['active'] = int(template.get('active', True))
+        values['court_type'] = values['court_type'] or ''
+        columns = ['id', *values]
+        with self._transaction() as conn:
+            conn.execute(f"INSERT OR REPLACE INTO templates ({', '.join(columns)}) "
+                         f"VALUES ({', '.join('?' * len(columns))})", (template['id'], *values.values()))
+        return self.get_template(template['id'])
+
+    def delete_template(self, template_id):
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM templates WHERE id = ?", (template_id,)).rowcount > 0
+
+    def list_terms(self):
+        rows = self._connection().execute("SELECT * FROM terms ORDER BY start_date").fetchall()
+        return [{'name': row['name'], 'startDate': row['start_date'], 'endDate': row['end_date']} for row in rows]
+
+    def save_term(self, name, start_date, end_date):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO terms (name, start_date, end_date) VALUES (?, ?, ?)",
+                         (name, start_date, end_date))
+
+    def sessions_from_templates(self, week):
+        """Sessions the active templates produce for the week starting on `week`, in config.json shape."""
+        terms = {term['name']: term for term in self.list_terms()}
+        sessions = []
+        for template in self.list_templates():
+            if template_applies(template, week, terms.get(template['term'])):
+                sessions.append({field: template[field] for field in
+                                 ('studentName', 'dayOfWeek', 'courtLocation', 'courtType', 'sessionStart',
+                                  'sessionEnd')})
+        sessions.sort(key=lambda session: (DAY_OF_WEEK_MAPPING[session['dayOfWeek']], session['sessionStart']))
+        for session in sessions:
+            session.update(statusMessaged=False, statusBooked=False, id=new_session_id(), version=1)
+        return sessions
+
+    def materialize_week(self, week, replace=False, make_current=False):
+        """Write the templates' sessions into a week; returns (sessions written, week was generated)."""
+        parse_week(week)
+        with self.lock:
+            sessions = self.sessions_from_templates(week)
+            current_week = self._meta(self._connection(), 'current_week')
+            with self._transaction() as conn:
+                existing = conn.execute("SELECT COUNT(*) AS n FROM sessions WHERE week_starting = ?",
+                                        (week,)).fetchone()['n']
+                stored = conn.execute("SELECT 1 FROM weeks WHERE week_starting = ?", (week,)).fetchone()
+                generated = replace or not stored
+                if generated:
+                    conn.execute("INSERT OR IGNORE INTO weeks (week_starting) VALUES (?)", (week,))
+                    conn.execute("DELETE FROM sessions WHERE week_starting = ?", (week,))
+                    for position, session in enumerate(sessions):
+                        self._upsert_session(conn, week, position, session)
+                if make_current or (generated and week == current_week):
+                    self._bump_revision(conn, week, int(self._meta(conn, 'config_version') or 0) + 1)
+            self._cache = None
+            return (len(sessions) if generated else existing), generated
+
+    def import_json(self, config_path='config.json', students_path='students.json'):
+        """Load the JSON files into the database; returns (week, session count)."""
+        students = load_json(students_path)
+        if students:
+            self.sync_students(students)
+        config = load_json(config_path)
+        if not config or not config.get('weekStarting'):
+            return None, 0
+        current = self.snapshot()
+        if current is not None and current['weekStarting'] != config['weekStarting']:
+            # Keep the stored week as history and add the imported one alongside it
+            config['version'] = current['version'] + 1
+        try:
+            self.write(config)
+        except ValueError as e:
+            print(f"Not importing {config_path}: {e}")
+            return None, 0
+        return config['weekStarting'], len(config.get('sessions', []))
+
+
+config_store = HistoryStore()
+# The students table follows students.json, which is edited by hand
+students_store = JsonStore('students.json', on_reload=config_store.sync_students)
+if config_store.is_empty():
+    imported_week, imported_count = config_store.import_json()
+    if imported_week:
+        print(f"Imported {imported_count} session(s) for {imported_week} from config.json into {HISTORY_DB}.")
+
+
+TEMPLATE_FREQUENCIES = ('weekly', 'fortnightly')
+
+
+def parse_date(value, what):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {what}: {value!r} (expected YYYY-MM-DD).")
+
+
+def date_today():
+    return datetime.now().date()
+
+
+def week_of(date_value):
+    return date_value - timedelta(days=date_value.weekday())
+
+
+def template_applies(template, week, term=None):
+    """Whether a template produces a session in the week starting on `week` (YYYY-MM-DD)."""
+    if not template['active']:
+        return False
+    week_start = parse_date(week, 'week')
+    session_date = week_start + timedelta(days=DAY_OF_WEEK_MAPPING[template['dayOfWeek']])
+    for bounds in (template, term):
+        if not bounds:
+            continue
+        if bounds.get('startDate') and session_date < parse_date(bounds['startDate'], 'start date'):
+            return False
+        if bounds.get('endDate') and session_date > parse_date(bounds['endDate'], 'end date'):
+            return False
+    if week in template['exceptions'] or session_date.isoformat() in template['exceptions']:
+        return False
+    if template['frequency'] == 'fortnightly':
+        weeks_apart = (week_start - parse_date(template['anchorWeek'], 'anchor week')).days // 7
+        return weeks_apart % 2 == 0
+    return True
+
+
+def validate_template(data, existing=None):
+    """Merge data over an existing template and check it; raises ValueError on bad input."""
+    template = dict(existing or {})
+    unknown = set(data) - set(HistoryStore.TEMPLATE_COLUMNS) - {'id'}
+    if unknown:
+        raise ValueError(f"Unknown template field(s): {sorted(unknown)}")
+    template.update({field: value for field, value in data.items() if field != 'id'})
+    for field in ('studentName', 'dayOfWeek', 'courtLocation', 'sessionStart', 'sessionEnd'):
+        if not template.get(field):
+            raise ValueError(f"Missing template field: {field}")
+    if template['dayOfWeek'] not in DAY_OF_WEEK_MAPPING:
+        raise ValueError(f"Invalid dayOfWeek: {template['dayOfWeek']}")
+    try:
+        start = datetime.strptime(template['sessionStart'], '%H:%M')
+        end = datetime.strptime(template['sessionEnd'], '%H:%M')
+    except (TypeError, ValueError):
+        raise ValueError("sessionStart and sessionEnd must be HH:MM times.")
+    if end <= start:
+        raise ValueError("sessionEnd must be after sessionStart.")
+    template.setdefault('frequency', 'weekly')
+    if template['frequency'] not in TEMPLATE_FREQUENCIES:
+        raise ValueError(f"frequency must be one of {TEMPLATE_FREQUENCIES}.")
+    anchor = template.get('anchorWeek') or template.get('startDate') or date_today().isoformat()
+    template['anchorWeek'] = week_of(parse_date(anchor, 'anchor week')).isoformat()
+    for field in ('startDate', 'endDate'):
+        if template.get(field):
+            parse_date(template[field], field)
+    if template.get('term') and template['term'] not in {term['name'] for term in config_store.list_terms()}:
+        raise ValueError(f"Unknown term: {template['term']}")
+    exceptions = template.get('exceptions') or []
+    if not isinstance(exceptions, list):
+        raise ValueError("exceptions must be a list of dates.")
+    for value in exceptions:
+        parse_date(value, 'exception date')
+    template['exceptions'] = exceptions
+    template.setdefault('active', True)
+    return template
+
+
+@app.route('/templates')
+def list_templates():
+    return jsonify(config_store.list_templates())
+
+
+@app.route('/templates', methods=['POST'])
+def add_template():
+    data = json_object()
+    if data is None:
+        return jsonify({'error': 'Expected a JSON object.'}), 400
+    try:
+        template = config_store.save_template(validate_template(data))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(template), 201
+
+
+@app.route('/templates/<template_id>', methods=['PATCH'])
+def update_template(template_id):
+    existing = config_store.get_template(template_id)
+    if existing is None:
+        return jsonify({'error': 'Template not found.'}), 404
+    data = json_object()
+    if data is None:
+        return jsonify({'error': 'Expected a JSON object.'}), 400
+    try:
+        template = config_store.save_template(validate_template(data, existing))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(template)
+
+
+@app.route('/templates/<template_id>', methods=['DELETE'])
+def delete_template(template_id):
+    if not config_store.delete_template(template_id):
+        return jsonify({'error': 'Template not found.'}), 404
+    return jsonify({'deleted': template_id})
+
+
+@app.route('/templates/from-week', methods=['POST'])
+def templates_from_week():
+    """Turn every session of the current week into a weekly template starting that week.
+
+    Sessions that an active template already covers are skipped, so saving the same week twice doesn't
+    make every generated session appear twice.
+    """
+    config = config_store.snapshot()
+    if not config:
+        return jsonify({'error': 'Config file not found or invalid.'}), 404
+    fields = ('studentName', 'dayOfWeek', 'courtLocation', 'courtType', 'sessionStart', 'sessionEnd')
+
+    def key(item):
+        return tuple(item.get(field) or None for field in fields)
+
+    existing = {key(template): template['id'] for template in config_store.list_templates() if template['active']}
+    created, skipped = [], []
+    for session in config['sessions']:
+        if key(session) in existing:
+            skipped.append({'id': session.get('id'), 'templateId': existing[key(session)],
+                            'error': "An active template already covers this session."})
+            continue
+        try:
+            template = validate_template({field: session[field] for field in fields})
+            template.update(anchorWeek=config['weekStarting'], startDate=config['weekStarting'])
+            template = config_store.save_template(template)
+        except (KeyError, ValueError) as e:
+            skipped.append({'id': session.get('id'), 'error': str(e)})
+            continue
+        existing[key(template)] = template['id']
+        created.append(template)
+    return jsonify({'created': created, 'skipped': skipped}), 201 if created else 200
+
+
+@app.route('/terms')
+def list_terms():
+    return jsonify(config_store.list_terms())
+
+
+@app.route('/terms', methods=['POST'])
+def add_term():
+    data = json_object()
+    if data is None:
+        return jsonify({'error': 'Expected a JSON object.'}), 400
+    try:
+        if not data.get('name'):
+            raise ValueError("Missing term name.")
+        if parse_date(data.get('endDate'), 'endDate') < parse_date(data.get('startDate'), 'startDate'):
+            raise ValueError("endDate must not be before startDate.")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    config_store.save_term(data['name'], data['startDate'], data['endDate'])
+    return jsonify({'name': data['name'], 'startDate': data['startDate'], 'endDate': data['endDate']}), 201
+
+
+def generate_weeks(first_week, count=1, replace=False, make_current=False):
+    first = week_of(parse_date(first_week, 'weekStarting'))
+    results = []
+    for offset in range(count):
+        week = (first + timedelta(weeks=offset)).isoformat()
+        sessions, generated = config_store.materialize_week(
+            week, replace=replace, make_current=make_current and offset == 0)
+        results.append({'weekStarting': week, 'sessions': sessions, 'generated': generated})
+    return results
+
+
+@app.route('/weeks/generate', methods=['POST'])
+def generate_week():
+    """Materialise sessions from templates for one or more weeks; existing weeks are kept unless replace is set."""
+    data = json_object()
+    if data is None:
+        return jsonify({'error': 'Expected a JSON object.'}), 400
+    try:
+        count = int(data.get('weeks', 1))
+        if not 1 <= count <= 52:
+            raise ValueError("weeks must be between 1 and 52.")
+        results = generate_weeks(data.get('weekStarting') or week_of(date_today()).isoformat(), count,
+                                 replace=bool(data.get('replace')), make_current=bool(data.get('makeCurrent')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(results)
+
+
+@app.cli.command('generate-weeks')
+@click.option('--from', 'first_week', default=None, help="First week to generate (defaults to this week).")
+@click.option('--weeks', default=4, show_default=True, help="Number of weeks to generate.")
+@click.option('--replace', is_flag=True, help="Regenerate weeks that already have sessions.")
+def generate_weeks_command(first_week, weeks, replace):
+    """Pre-compute upcoming weeks' sessions from the recurring templates."""
+    for result in generate_weeks(first_week or week_of(date_today()).isoformat(), weeks, replace=replace):
+        state = "generated" if result['generated'] else "kept existing"
+        click.echo(f"{result['weekStarting']}: {result['sessions']} session(s), {state}")
+
+
+@app.cli.command('import-history')
+@click.option('--config', 'config_path', default='config.json', help="Week config to import.")
+@click.option('--students', 'students_path', default='students.json', help="Students file to import.")
+def import_history(config_path, students_path):
+    """Import a config.json week and students.json into the history database."""
+    week, count = config_store.import_json(config_path, students_path)
+    click.echo(f"Imported {count} session(s) for {week}." if week else "No week found to import.")
+
+
+def json_object():
+    """The request's JSON body as a dict ({} when empty), or None when it is something other than an object."""
+    data = request.get_json(silent=True)
+    if data is None and not request.get_data():
+        return {}
+    return data if isinstance(data, dict) else None
+
+
+def conditional_json(data, etag):
+    # Answers If-None-Match with 304 when the client already has this version
+    response = make_response(jsonify(data))
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
+# Step Tracing
+class Histogram:
+    """Prometheus-style cumulative histogram keyed by label values."""
+
+    def __init__(self, name, help_text, labels, buckets=METRIC_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self._lock:
+            series = self._series.setdefault(key, {'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0})
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+            series['count'] += 1
+            series['sum'] += value
+
+    def render(self):
+        def label_text(key, extra=()):
+            pairs = [*zip(self.labels, key), *extra]
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+            return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: copy.deepcopy(value) for key, value in sorted(self._series.items())}
+        for key, values in series.items():
+            for bound, count in zip(self.buckets, values['buckets']):
+                lines.append(f"{self.name}_bucket{label_text(key, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{label_text(key, [('le', '+Inf')])} {values['count']}")
+            lines.append(f"{self.name}_sum{label_text(key)} {values['sum']:.6f}")
+            lines.append(f"{self.name}_count{label_text(key)} {values['count']}")
+        return lines
+
+
+class StepTracer:
+    """Times named steps of the automation tasks.
+
+    Each step feeds a histogram and is appended to the JSON lines log with its duration, outcome and
+    error, plus any fields bound for the current thread (such as the job it runs in). The log is rotated
+    once it passes max_bytes, keeping `backups` older files.
+    """
+
+    def __init__(self, log_path=STEP_LOG, max_bytes=STEP_LOG_MAX_BYTES, backups=STEP_LOG_BACKUPS):
+        self.log_path = log_path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.steps = Histogram('automation_step_seconds', "Duration of automation steps.", ('step', 'outcome'))
+        self.waits = Histogram('automation_wait_seconds', "Duration of explicit browser waits.", ('step', 'outcome'))
+        self.jobs = Histogram('automation_job_seconds', "Duration of background jobs.", ('type', 'state'))
+        self._local = threading.local()
+        self._log_lock = threading.Lock()
+
+    @contextmanager
+    def bind(self, **fields):
+        previous = getattr(self._local, 'fields', {})
+        self._local.fields = {**previous, **fields}
+        try:
+            yield
+        finally:
+            self._local.fields = previous
+
+    def log(self, record):
+        if not self.log_path:
+            return
+        record = {'ts': datetime.now().isoformat(timespec='milliseconds'), **getattr(self._local, 'fields', {}),
+                  **record}
+        line = json.dumps(record, default=str)
+        try:
+            with self._log_lock:
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+                    size = f.tell()
+                if self.max_bytes and size >= self.max_bytes:
+                    self._rotate()
+        except OSError as e:
+            print(f"Error writing {self.log_path}: {e}")
+
+    def _rotate(self):
+        # Every worker appends to the same file, so rotate under a host-wide lock and only if no other worker
+        # rotated it in the meantime; a write racing the rename lands in the .1 file, which is harmless
+        with ProcessLock('step-log'):
+            try:
+                if os.path.getsize(self.log_path) < self.max_bytes:
+                    return
+            except FileNotFoundError:
+                return
+            if self.backups < 1:
+                os.remove(self.log_path)
+                return
+            for index in range(self.backups - 1, 0, -1):
+                source = f"{self.log_path}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.log_path}.{index + 1}")
+            os.replace(self.log_path, f"{self.log_path}.1")
+
+    @contextmanager
+    def step(self, name, **context):
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            seconds = time.monotonic() - started
+            self.steps.observe(seconds, step=name, outcome='error')
+            self.log({'step': name, 'seconds': round(seconds, 4), 'outcome': 'error',
+                      'error': f"{type(e).__name__}: {e}", **context})
+            raise
+        seconds = time.monotonic() - started
+        self.steps.observe(seconds, step=name, outcome='ok')
+        self.log({'step': name, 'seconds': round(seconds, 4), 'outcome': 'ok', **context})
+
+    def record_wait(self, step, seconds, ok):
+        outcome = 'ok' if ok else 'timeout'
+        self.waits.observe(seconds, step=step, outcome=outcome)
+        self.log({'wait': step, 'seconds': round(seconds, 4), 'outcome': outcome})
+
+    def render_metrics(self):
+        return '\n'.join([*self.steps.render(), *self.waits.render(), *self.jobs.render()]) + '\n'
+
+
+tracer = StepTracer()
+
+
+@app.route('/metrics')
+def metrics():
+    # Histograms live in this worker process only; see gunicorn.conf.py when running more than one
+    return Response(tracer.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+# Google Calendar credentials and client are shared by every calendar write in the process
+_calendar_lock = threading.Lock()
+_calendar_creds = None
+_calendar_service = None
+_calendar_local = threading.local()
+
+
+def save_calendar_token(creds):
+    try:
+        with open(CALENDAR_TOKEN_FILE, 'wb') as f:
+            pickle.dump(creds, f)
+    except Exception as e:
+        print(f"Error saving {CALENDAR_TOKEN_FILE}: {e}")
+
+
+def get_calendar_credentials():
+    global _calendar_creds
+    with _calendar_lock:
+        creds = _calendar_creds
+        if creds is None and os.path.exists(CALENDAR_TOKEN_FILE):
+            try:
+                with open(CALENDAR_TOKEN_FILE, 'rb') as f:
+                    creds = pickle.load(f)
+            except Exception as e:
+                print(f"Error loading {CALENDAR_TOKEN_FILE}: {e}")
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                try:
+                    from google.auth.transport.requests import Request
+                    creds.refresh(Request())
+                except Exception as e:
+                    print(f"Error refreshing calendar token: {e}")
+                    creds = None
+            if not creds or not creds.valid:
+                from google_auth_oauthlib.flow import InstalledAppFlow
+                flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
+                creds = flow.run_local_server(port=0)
+            save_calendar_token(creds)
+        _calendar_creds = creds
+        return creds
+
+
+def _build_calendar_request(http, *args, **kwargs):
+    import httplib2
+    import google_auth_httplib2
+    from googleapiclient.http import HttpRequest
+
+    # httplib2 is not thread-safe, so each thread gets its own authorized connection
+    creds = _calendar_creds
+    if getattr(_calendar_local, 'creds', None) is not creds:
+        _calendar_local.http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())
+        _calendar_local.creds = creds
+    return HttpRequest(_calendar_local.http, *args, **kwargs)
+
+
 def get_calendar_service():
-    creds = None
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-    return build('calendar', 'v3', credentials=creds)
+    global _calendar_service
+    creds = get_calendar_credentials()
+    with _calendar_lock:
+        if _calendar_service is None:
+            from googleapiclient.discovery import build
+            _calendar_service = build('calendar', 'v3', credentials=creds,
+                                      requestBuilder=_build_calendar_request, cache_discovery=False)
+        return _calendar_service
 
 
-def click_element_with_retry(driver, element, retries=3, delay=1):
+def click_element_with_retry(driver, element, retries=3, delay=WAIT_POLL_INTERVAL):
     for attempt in range(retries):
         try:
+            started = time.monotonic()
             element.click()
+            step_timings.record('click_block', time.monotonic() - started, True)
             print(f"Clicked on element: {element.get_attribute('title') or element.tag_name}")
             return True
         except StaleElementReferenceException:
@@ -85,48 +1325,532 @@ def click_element_with_retry(driver, element, retries=3, delay=1):
 
 
 # Google Calendar Integration
-def add_event_to_calendar(starting_week, student_name, day_of_week, court_location, session_start, session_end):
-    service = get_calendar_service()
+def calendar_event_id(starting_week, student_name, day_of_week, session_start):
+    # Hex digits are valid base32hex, so the digest can be used directly as a Calendar event ID
+    key = f"{starting_week}|{student_name}|{day_of_week}|{session_start}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def build_calendar_event(starting_week, student_name, day_of_week, court_location, session_start, session_end):
     starting_date = datetime.strptime(starting_week, "%Y-%m-%d")
     booking_date = starting_date + timedelta(days=DAY_OF_WEEK_MAPPING[day_of_week])
 
     start_time = datetime.combine(booking_date, datetime.strptime(session_start, '%H:%M').time())
     end_time = datetime.combine(booking_date, datetime.strptime(session_end, '%H:%M').time())
 
-    event = {
+    return {
+        'id': calendar_event_id(starting_week, student_name, day_of_week, session_start),
+        'status': 'confirmed',
         'summary': f'Coaching Session for {student_name} at {court_location}',
         'location': court_location,
         'start': {'dateTime': start_time.isoformat(), 'timeZone': TIMEZONE},
         'end': {'dateTime': end_time.isoformat(), 'timeZone': TIMEZONE},
         'reminders': {'useDefault': True},
+        'extendedProperties': {'private': {
+            'weekStarting': starting_week,
+            'studentName': student_name,
+            'dayOfWeek': day_of_week,
+            'sessionStart': session_start,
+        }},
     }
 
+
+def _is_conflict(error):
+    from googleapiclient.errors import HttpError
+    return isinstance(error, HttpError) and error.resp.status == 409
+
+
+def add_event_to_calendar(starting_week, student_name, day_of_week, court_location, session_start, session_end):
+    from googleapiclient.errors import HttpError
+
+    service = get_calendar_service()
+    event = build_calendar_event(starting_week, student_name, day_of_week, court_location, session_start, session_end)
+
     try:
-        event_result = service.events().insert(calendarId='primary', body=event).execute()
-        print(f"Event created: {event_result.get('htmlLink')}")
-        return f"Event created: {event_result.get('htmlLink')}"
+        with tracer.step('calendar_insert', eventId=event['id']):
+            try:
+                event_result = service.events().insert(calendarId=CALENDAR_ID, body=event).execute()
+                action = "created"
+            except HttpError as e:
+                if not _is_conflict(e):
+                    raise
+                # The event already exists, so update it in place rather than duplicating it
+                event_result = service.events().update(calendarId=CALENDAR_ID, eventId=event['id'],
+                                                       body=event).execute()
+                action = "updated"
+        print(f"Event {action}: {event_result.get('htmlLink')}")
+        return f"Event {action}: {event_result.get('htmlLink')}"
     except Exception as e:
         print(f"An error occurred: {e}")
-        return f"An error occurred: {e}"
+        raise
+
+
+def execute_calendar_batch(service, calls):
+    """Send (key, request) pairs as Calendar API batch requests.
+
+    Returns {key: (response, exception)} for every call.
+    """
+    responses = {}
+    keys = {}
+
+    def callback(request_id, response, exception):
+        responses[keys[request_id]] = (response, exception)
+
+    for offset in range(0, len(calls), CALENDAR_BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=callback)
+        for key, call in calls[offset:offset + CALENDAR_BATCH_SIZE]:
+            keys[str(key)] = key
+            batch.add(call, request_id=str(key))
+        with tracer.step('calendar_batch', calls=len(calls[offset:offset + CALENDAR_BATCH_SIZE])):
+            batch.execute()
+    return responses
+
+
+def sync_week_to_calendar(starting_week, sessions, service=None):
+    """Insert or update one calendar event per session using batched requests.
+
+    Event IDs are derived from (weekStarting, student, day, start), so re-running the sync updates
+    existing events instead of creating duplicates.
+    """
+    service = service or get_calendar_service()
+    events, results = {}, {}
+
+    def result(index, status, detail, event_id=None):
+        session = sessions[index]
+        results[index] = {
+            'index': index,
+            'studentName': session.get('studentName'),
+            'dayOfWeek': session.get('dayOfWeek'),
+            'sessionStart': session.get('sessionStart'),
+            'eventId': event_id,
+            'status': status,
+            'detail': detail,
+        }
+
+    for index, session in enumerate(sessions):
+        try:
+            events[index] = build_calendar_event(
+                starting_week, session['studentName'], session['dayOfWeek'], session['courtLocation'],
+                session['sessionStart'], session['sessionEnd'])
+        except (KeyError, ValueError) as e:
+            result(index, 'failed', f"Invalid session: {e}")
+
+    inserted = execute_calendar_batch(
+        service, [(index, service.events().insert(calendarId=CALENDAR_ID, body=event))
+                  for index, event in events.items()])
+
+    conflicts = []
+    for index, (response, error) in inserted.items():
+        if error is None:
+            result(index, 'created', response.get('htmlLink'), response.get('id'))
+        elif _is_conflict(error):
+            conflicts.append(index)
+        else:
+            result(index, 'failed', str(error), events[index]['id'])
+
+    updated = execute_calendar_batch(
+        service, [(index, service.events().update(calendarId=CALENDAR_ID, eventId=events[index]['id'],
+                                                  body=events[index]))
+                  for index in conflicts])
+    for index, (response, error) in updated.items():
+        if error is None:
+            result(index, 'updated', response.get('htmlLink'), response.get('id'))
+        else:
+            result(index, 'failed', str(error), events[index]['id'])
+
+    print(f"Synced {len(results)} session(s) for week {starting_week} to calendar.")
+    return [results[index] for index in sorted(results)]
+
+
+# Background Jobs
+class Job:
+    def __init__(self, job_type, description, worker=None):
+        self.id = uuid.uuid4().hex
+        self.worker = worker
+        self.type = job_type
+        self.description = description
+        self.state = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+
+    def to_dict(self):
+        def iso(ts):
+            return datetime.fromtimestamp(ts).isoformat() if ts else None
+
+        return {
+            'id': self.id,
+            'type': self.type,
+            'description': self.description,
+            'state': self.state,
+            'createdAt': iso(self.created_at),
+            'startedAt': iso(self.started_at),
+            'finishedAt': iso(self.finished_at),
+            'queuedSeconds': round((self.started_at or time.time()) - self.created_at, 3),
+            'runSeconds': round((self.finished_at or time.time()) - self.started_at, 3) if self.started_at else None,
+            'result': self.result,
+            'error': self.error,
+            'worker': self.worker,
+        }
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobScheduler:
+    """Runs background tasks on a bounded worker pool with a concurrency limit per job type.
+
+    Jobs over their type's limit wait in a per-type queue instead of occupying a worker. With a store,
+    every state change is saved so any WSGI worker process can report on the job, and types limited to
+    one job at a time also take a ProcessLock so they never run concurrently in two workers.
+
+    Each scheduler holds a "worker-<id>" ProcessLock for as long as its process lives. On start it fails the
+    stored queued/running jobs whose worker lock is free, as those workers crashed or were restarted.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, type_limits=None, queue_limit=JOB_QUEUE_LIMIT, store=None):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._type_limits = type_limits or {}
+        self._queue_limit = queue_limit
+        self._running = {}
+        self._pending = {}
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        if store is not None:
+            self._worker_lock = ProcessLock(f"worker-{self.worker_id}")
+            self._worker_lock.acquire()
+            atexit.register(self._release_worker_lock)
+            self.reconcile()
+
+    def _release_worker_lock(self):
+        try:
+            os.remove(self._worker_lock.path)
+        except OSError:
+            pass
+        self._worker_lock.release()
+
+    def reconcile(self):
+        """Mark stored jobs left queued or running by a worker process that no longer exists as failed."""
+        try:
+            jobs = self.store.list_jobs(state=('queued', 'running'), limit=None)
+        except sqlite3.Error as e:
+            print(f"Could not read stored jobs: {e}")
+            return 0
+        failed = 0
+        for job in jobs:
+            if job.get('worker') == self.worker_id:
+                continue
+            if job.get('worker'):
+                lock = ProcessLock(f"worker-{job['worker']}")
+                if not lock.acquire(blocking=False):
+                    continue  # That worker is still running it
+                try:
+                    os.remove(lock.path)
+                except OSError:
+                    pass
+                lock.release()
+            job.update(state='failed', finishedAt=datetime.now().isoformat(),
+                       error="Interrupted: the worker process running this job stopped.")
+            try:
+                self.store.save_job(job)
+                failed += 1
+            except sqlite3.Error as e:
+                print(f"Could not save job {job['id']}: {e}")
+        if failed:
+            print(f"Marked {failed} job(s) from stopped worker processes as failed.")
+        return failed
+
+    def submit(self, job_type, description, func, *args):
+        with self._lock:
+            active = sum(1 for job in self._jobs.values() if job.state in ('queued', 'running'))
+            if active >= self._queue_limit:
+                raise JobQueueFull(f"Too many jobs in progress ({active}).")
+            job = Job(job_type, description, self.worker_id)
+            self._jobs[job.id] = job
+            self._prune()
+            limit = self._type_limits.get(job_type)
+            waiting = limit is not None and self._running.get(job_type, 0) >= limit
+            if waiting:
+                self._pending.setdefault(job_type, deque()).append((job, func, args))
+            else:
+                self._running[job_type] = self._running.get(job_type, 0) + 1
+        # Saved while still queued too, so /jobs in every worker process lists jobs waiting for their type
+        self._persist(job)
+        if not waiting:
+            self._executor.submit(self._run, job, func, args)
+        return job
+
+    def _persist(self, job):
+        if self.store is None:
+            return
+        try:
+            self.store.save_job(job.to_dict())
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"Could not save job {job.id}: {e}")
+
+    def _run(self, job, func, args):
+        type_lock = ProcessLock(f"job-{job.type}") if self._type_limits.get(job.type) == 1 else None
+        try:
+            if type_lock:
+                # Stays queued while another worker process runs a job of this type
+                type_lock.acquire()
+            job.state = 'running'
+            job.started_at = time.time()
+            self._persist(job)
+            with tracer.bind(job=job.id, jobType=job.type):
+                job.result = func(*args)
+            job.state = 'succeeded'
+        except Exception as e:
+            traceback.print_exc()
+            job.error = f"{type(e).__name__}: {e}"
+            job.state = 'failed'
+        finally:
+            if type_lock and job.started_at:
+                type_lock.release()
+            job.finished_at = time.time()
+            job.started_at = job.started_at or job.finished_at
+            tracer.jobs.observe(job.finished_at - job.started_at, type=job.type, state=job.state)
+            print(f"Job {job.id} ({job.type}) {job.state} in {job.finished_at - job.started_at:.1f}s.")
+            self._persist(job)
+            self._start_next(job.type)
+
+    def _start_next(self, job_type):
+        with self._lock:
+            pending = self._pending.get(job_type)
+            if not pending:
+                self._running[job_type] -= 1
+                return
+            next_job = pending.popleft()
+        self._executor.submit(self._run, *next_job)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in ('succeeded', 'failed')]
+        for job_id in finished[:max(0, len(finished) - JOB_HISTORY_LIMIT)]:
+            del self._jobs[job_id]
+        if self.store is not None and finished:
+            try:
+                self.store.prune_jobs()
+            except sqlite3.Error as e:
+                print(f"Could not prune stored jobs: {e}")
+
+    def get(self, job_id):
+        """The job as a dict, from this process or, failing that, from the store."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return self.store.get_job(job_id) if self.store is not None else None
+
+    def list(self, state=None, job_type=None):
+        if self.store is not None:
+            return self.store.list_jobs(state=state, job_type=job_type)
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job.to_dict() for job in reversed(jobs)
+                if (state is None or job.state == state) and (job_type is None or job.type == job_type)]
+
+
+job_scheduler = JobScheduler(type_limits=JOB_TYPE_LIMITS, store=config_store)
+
+
+def run_with_outcome(session_id, kind, func, *args):
+    """Run a task and record its outcome against the session in the history store."""
+    try:
+        result = func(*args)
+    except Exception as e:
+        config_store.record_outcome(session_id, kind, 'failed', f"{type(e).__name__}: {e}")
+        raise
+    config_store.record_outcome(session_id, kind, 'succeeded', result)
+    return result
+
+
+def submit_job(job_type, description, func, *args):
+    try:
+        job = job_scheduler.submit(job_type, description, func, *args)
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify({'message': f"{description} in progress!", 'jobId': job.id, 'state': job.state}), 202
+
+
+@app.route('/jobs')
+def list_jobs():
+    return jsonify(job_scheduler.list(state=request.args.get('state'), job_type=request.args.get('type')))
+
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = job_scheduler.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found.'}), 404
+    return jsonify(job)
 
 
 # Flask Routes for Configuration
 @app.route('/config')
 def get_config():
-    config = load_json('config.json')
+    config, etag = config_store.read()
     if config is not None:
-        return jsonify(config)
+        return conditional_json(config, etag)
     return jsonify({'error': 'Config file not found or invalid.'}), 404
 
 
 @app.route('/save-config', methods=['POST'])
 def save_config():
     config_data = request.get_json()
-    if not config_data:
+    if not isinstance(config_data, dict) or not config_data:
         return jsonify({"error": "Invalid data received."}), 400
-    if save_json('config.json', config_data):
-        return jsonify({"message": "Configuration saved successfully."}), 200
-    return jsonify({"error": "Failed to save configuration."}), 500
+    try:
+        parse_week(config_data.get('weekStarting'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    sessions = config_data.setdefault('sessions', [])
+    if not isinstance(sessions, list) or not all(isinstance(session, dict) for session in sessions):
+        return jsonify({"error": "sessions must be a list of session objects."}), 400
+
+    def replace(config):
+        check_version(config_data.get('version'), config.get('version'), 'configuration')
+        previous = {session.get('id'): session for session in config.get('sessions', [])}
+        for session in config_data.get('sessions', []):
+            old = previous.get(session.get('id'))
+            if old is None:
+                session['id'] = session.get('id') or new_session_id()
+                session['version'] = 1
+            else:
+                changed = any(session.get(field) != old.get(field) for field in SESSION_FIELDS)
+                session['version'] = old.get('version', 1) + (1 if changed else 0)
+        config_data['version'] = config.get('version', 0) + 1
+        config.clear()
+        config.update(config_data)
+        return config['version']
+
+    try:
+        version, etag = config_store.update(replace)
+    except VersionConflict as e:
+        return jsonify({"error": str(e)}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    response = jsonify({"message": "Configuration saved successfully.", "version": version})
+    response.set_etag(etag)
+    return response, 200
+
+
+def _patch_config(func):
+    """Run func against the stored config and turn its failures into JSON error responses."""
+    try:
+        result, etag = config_store.update(func)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except VersionConflict as e:
+        body = {'error': str(e)}
+        if e.current is not None:
+            body['session'] = e.current
+        return jsonify(body), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response = jsonify(result)
+    response.set_etag(etag)
+    return response, 200
+
+
+def _session_changes(data):
+    unknown = set(data) - set(SESSION_FIELDS) - {'version'}
+    if unknown:
+        raise ValueError(f"Unknown session field(s): {sorted(unknown)}")
+    return {field: data[field] for field in SESSION_FIELDS if field in data}
+
+
+@app.route('/config', methods=['PATCH'])
+def patch_config():
+    data = json_object()
+    if data is None or 'weekStarting' not in data:
+        return jsonify({'error': 'Only weekStarting can be patched.'}), 400
+
+    try:
+        parse_week(data['weekStarting'])
+        version = config_store.switch_week(data['weekStarting'], data.get('version'))
+    except VersionConflict as e:
+        return jsonify({'error': str(e)}), 409
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'weekStarting': data['weekStarting'], 'configVersion': version}), 200
+
+
+@app.route('/history/sessions')
+def history_sessions():
+    return jsonify(config_store.query_sessions(
+        student=request.args.get('student'), location=request.args.get('location'),
+        start=request.args.get('from'), end=request.args.get('to')))
+
+
+@app.route('/history/costs')
+def history_costs():
+    return jsonify(config_store.cost_per_student_month(start=request.args.get('from'), end=request.args.get('to')))
+
+
+@app.route('/sessions', methods=['POST'])
+def add_session():
+    data = json_object()
+    if data is None:
+        return jsonify({'error': 'Expected a JSON object.'}), 400
+
+    def apply(config):
+        if not config:
+            raise LookupError('Config file not found or invalid.')
+        session = {field: data.get(field, False if field.startswith('status') else '') for field in SESSION_FIELDS}
+        session.update(_session_changes(data))
+        session['id'] = new_session_id()
+        session['version'] = 1
+        config['sessions'].append(session)
+        config['version'] += 1
+        return {'session': session, 'configVersion': config['version']}
+
+    return _patch_config(apply)
+
+
+@app.route('/sessions/<session_id>', methods=['PATCH'])
+def update_session(session_id):
+    data = json_object()
+    if data is None:
+        return jsonify({'error': 'Expected a JSON object.'}), 400
+
+    def apply(config):
+        session = find_session(config, session_id)
+        if session is None:
+            raise LookupError('Session not found.')
+        try:
+            check_version(data.get('version'), session['version'], 'session')
+        except VersionConflict as e:
+            e.current = session
+            raise
+        session.update(_session_changes(data))
+        touch_session(config, session)
+        return {'session': session, 'configVersion': config['version']}
+
+    return _patch_config(apply)
+
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    version = request.args.get('version')
+
+    def apply(config):
+        session = find_session(config, session_id)
+        if session is None:
+            raise LookupError('Session not found.')
+        try:
+            check_version(version, session['version'], 'session')
+        except VersionConflict as e:
+            e.current = session
+            raise
+        config['sessions'].remove(session)
+        config['version'] += 1
+        return {'deleted': session_id, 'configVersion': config['version']}
+
+    return _patch_config(apply)
 
 
 # Flask Route to Add Event to Calendar
@@ -136,306 +1860,1509 @@ def add_to_calendar():
     required_fields = ['startingWeek', 'studentName', 'dayOfWeek', 'courtLocation', 'sessionStart', 'sessionEnd']
     if not data or not all(field in data for field in required_fields):
         return "Missing required fields.", 400
-    threading.Thread(target=add_event_to_calendar, args=(
+    return submit_job(
+        'add-to-calendar', "Adding event to calendar", run_with_outcome,
+        data.get('sessionId'), 'calendar', add_event_to_calendar,
         data['startingWeek'], data['studentName'], data['dayOfWeek'], data['courtLocation'],
         data['sessionStart'], data['sessionEnd']
-    )).start()
-    return "Adding event to calendar in progress!", 200
+    )
+
+
+@app.route('/sync-calendar', methods=['POST'])
+def sync_calendar():
+    config = config_store.snapshot()
+    if not config or not config.get('weekStarting'):
+        return jsonify({'error': 'Config file not found or has no weekStarting.'}), 404
+    return submit_job(
+        'sync-calendar', f"Syncing week of {config['weekStarting']} to calendar", sync_calendar_task, config)
+
+
+def sync_calendar_task(config):
+    results = sync_week_to_calendar(config['weekStarting'], config.get('sessions', []))
+    for result in results:
+        config_store.record_outcome(config['sessions'][result['index']]['id'], 'calendar', result['status'],
+                                    result['detail'])
+    return results
 
 
 # Selenium Setup
-def get_chrome_driver():
+_chromedriver_lock = threading.Lock()
+_chromedriver_path = None
+
+
+def resolve_chromedriver_path(refresh=False):
+    """Find the chromedriver binary once per process and remember it on disk for later starts.
+
+    Tries CHROMEDRIVER_PATH, then the path cached in CHROMEDRIVER_CACHE, then webdriver_manager (which may
+    download a driver), then chromedriver on PATH. Returns None to leave it to Selenium Manager.
+    """
+    global _chromedriver_path
+    with _chromedriver_lock:
+        if _chromedriver_path and not refresh and os.path.exists(_chromedriver_path):
+            return _chromedriver_path
+        path = CHROMEDRIVER_PATH
+        if not path and not refresh:
+            try:
+                with open(CHROMEDRIVER_CACHE, encoding='utf-8') as f:
+                    path = f.read().strip()
+            except OSError:
+                path = None
+            if path and not os.path.exists(path):
+                path = None
+        if not path:
+            try:
+                from webdriver_manager.chrome import ChromeDriverManager
+                path = ChromeDriverManager().install()
+            except Exception as e:
+                print(f"Could not resolve chromedriver with webdriver_manager: {e}")
+                path = shutil.which('chromedriver')
+            if path:
+                try:
+                    with open(CHROMEDRIVER_CACHE, 'w', encoding='utf-8') as f:
+                        f.write(path)
+                except OSError as e:
+                    print(f"Error writing {CHROMEDRIVER_CACHE}: {e}")
+        _chromedriver_path = path
+        return path
+
+
+@app.cli.command('resolve-chromedriver')
+@click.option('--refresh', is_flag=True, help="Ignore the cached path and resolve again.")
+def resolve_chromedriver_command(refresh):
+    """Resolve and cache the chromedriver path ahead of time, e.g. while online or at deploy."""
+    click.echo(resolve_chromedriver_path(refresh=refresh) or "No chromedriver found; Selenium Manager will be used.")
+
+
+def get_chrome_driver(profile_dir=None):
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
+
     chrome_options = Options()
     chrome_options.add_argument("--disable-blink-features=AutomationControlled")
     chrome_options.add_argument("--disable-infobars")
     chrome_options.add_argument("--no-sandbox")
     chrome_options.add_argument("--disable-dev-shm-usage")
-    return webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
+    if profile_dir:
+        chrome_options.add_argument(f"--user-data-dir={os.path.abspath(profile_dir)}")
+    driver_path = resolve_chromedriver_path()
+    try:
+        return webdriver.Chrome(service=Service(driver_path) if driver_path else Service(), options=chrome_options)
+    except SessionNotCreatedException as e:
+        if CHROMEDRIVER_PATH:
+            raise
+        # Usually Chrome auto-updated past the cached chromedriver, so resolve it again once
+        print(f"Chrome session could not be created ({e.msg}); resolving chromedriver again.")
+        driver_path = resolve_chromedriver_path(refresh=True)
+        return webdriver.Chrome(service=Service(driver_path) if driver_path else Service(), options=chrome_options)
 
 
 def load_cookies(driver, url, cookie_file):
-    try:
+    """Replay saved cookies into the browser; returns how many were accepted. Browser errors propagate."""
+    with tracer.step('navigation', url=url):
         driver.get(url)
-        driver.delete_all_cookies()
-        cookies = load_json(cookie_file)
-        if not cookies:
-            print(f"No cookies found in {cookie_file}.")
+    driver.delete_all_cookies()
+    cookies = load_json(cookie_file)
+    if not cookies:
+        print(f"No cookies found in {cookie_file}.")
+        return 0
+    loaded = 0
+    for cookie in cookies:
+        cookie['domain'] = cookie.get('domain', '').lstrip('.')
+        if 'sameSite' in cookie and cookie['sameSite'] not in ["Strict", "Lax", "None"]:
+            del cookie['sameSite']
+        try:
+            driver.add_cookie(cookie)
+            loaded += 1
+        except WebDriverException as e:
+            print(f"Error adding cookie {cookie.get('name')} from {cookie_file}: {e}")
+    with tracer.step('navigation', url=url, reason='refresh'):
+        driver.refresh()
+    print(f"Loaded {loaded}/{len(cookies)} cookies from {cookie_file} and refreshed {url}.")
+    return loaded
+
+
+# Browser Session State
+SAME_SITE_TO_CDP = {'lax': 'Lax', 'strict': 'Strict', 'no_restriction': 'None'}
+
+
+def site_domain(site):
+    host = urllib.parse.urlsplit(COOKIE_SITES[site][0]).hostname or ''
+    return host[4:] if host.startswith('www.') else host
+
+
+def cookie_matches_domain(cookie, domain):
+    cookie_domain = cookie.get('domain', '').lstrip('.')
+    return cookie_domain == domain or cookie_domain.endswith('.' + domain) or domain.endswith('.' + cookie_domain)
+
+
+def cookie_to_cdp(cookie):
+    # Cookie files use the browser-extension export format (expirationDate, hostOnly, lower-case sameSite)
+    cdp_cookie = {key: cookie[key] for key in ('name', 'value', 'path', 'secure', 'httpOnly') if key in cookie}
+    if cookie.get('hostOnly'):
+        cdp_cookie['url'] = f"https://{cookie['domain']}{cookie.get('path', '/')}"
+    else:
+        cdp_cookie['domain'] = cookie['domain']
+    if cookie.get('sameSite') in SAME_SITE_TO_CDP:
+        cdp_cookie['sameSite'] = SAME_SITE_TO_CDP[cookie['sameSite']]
+    if not cookie.get('session') and cookie.get('expirationDate'):
+        cdp_cookie['expires'] = cookie['expirationDate']
+    return cdp_cookie
+
+
+def cookie_from_cdp(cdp_cookie):
+    same_site = {value: key for key, value in SAME_SITE_TO_CDP.items()}.get(cdp_cookie.get('sameSite'), 'unspecified')
+    cookie = {
+        'domain': cdp_cookie['domain'],
+        'hostOnly': not cdp_cookie['domain'].startswith('.'),
+        'httpOnly': cdp_cookie.get('httpOnly', False),
+        'name': cdp_cookie['name'],
+        'path': cdp_cookie.get('path', '/'),
+        'sameSite': same_site,
+        'secure': cdp_cookie.get('secure', False),
+        'session': cdp_cookie.get('session', False),
+        'storeId': '0',
+        'value': cdp_cookie['value'],
+    }
+    if not cookie['session']:
+        cookie['expirationDate'] = cdp_cookie.get('expires')
+    return cookie
+
+
+class LoginExpired(Exception):
+    """Neither the browser nor the saved cookie file has a live login for the site."""
+
+
+class SessionStateManager:
+    """Keeps browser logins alive across runs.
+
+    Each pooled browser uses a persistent Chrome profile (one per pool slot), so logins survive restarts
+    and warm browsers skip cookie replay. When a site's login cookie is missing from the browser the saved
+    cookies are replayed in a single DevTools call, and after each task the browser's cookies for the
+    sites it used are written back to their JSON files. Logins whose cookies have expired everywhere raise
+    LoginExpired rather than being replayed, so the task fails before it reaches a login page.
+    """
+
+    def __init__(self, profile_dir=BROWSER_PROFILE_DIR, slots=BROWSER_PROFILE_SLOTS):
+        self.profile_dir = profile_dir
+        self.slots = slots if profile_dir else 0
+        self._lock = threading.Lock()
+        self._profile_locks = {}
+        self._status = {}
+
+    def acquire_profile(self):
+        """Claim a free profile directory, or None for a throwaway profile when every slot is taken.
+
+        A profile can only be open in one Chrome at a time, so slots are claimed with a ProcessLock that
+        also keeps other worker processes off them.
+        """
+        for slot in range(self.slots):
+            lock = ProcessLock(f"profile-slot-{slot}")
+            if lock.acquire(blocking=False):
+                profile = os.path.join(self.profile_dir, f"slot-{slot}")
+                os.makedirs(profile, exist_ok=True)
+                with self._lock:
+                    self._profile_locks[profile] = lock
+                return profile
+        return None
+
+    def release_profile(self, profile):
+        with self._lock:
+            lock = self._profile_locks.pop(profile, None)
+        if lock:
+            lock.release()
+
+    @staticmethod
+    def browser_cookies(driver):
+        return [cookie_from_cdp(cookie) for cookie in driver.execute_cdp_cmd('Network.getAllCookies', {})['cookies']]
+
+    @staticmethod
+    def has_login(cookies, site, now=None):
+        now = now or time.time()
+        name = LOGIN_COOKIES.get(site)
+        return any(
+            cookie_matches_domain(cookie, site_domain(site)) and (name is None or cookie['name'] == name)
+            and (cookie.get('session') or not cookie.get('expirationDate') or cookie['expirationDate'] > now)
+            for cookie in cookies
+        )
+
+    def _set_status(self, site, **fields):
+        with self._lock:
+            self._status.setdefault(site, {'site': site}).update(fields)
+
+    def status(self):
+        with self._lock:
+            return [dict(self._status[site]) for site in sorted(self._status)]
+
+    def ensure_login(self, driver, site):
+        """Make sure the browser is logged in to site; returns 'warm' or 'replayed', or raises LoginExpired."""
+        url, cookie_file = COOKIE_SITES[site]
+        checked_at = datetime.now().isoformat(timespec='seconds')
+        try:
+            with tracer.step('session_check', site=site):
+                warm = self.has_login(self.browser_cookies(driver), site)
+        except WebDriverException as e:
+            # Without DevTools access fall back to navigating and replaying cookies one by one
+            print(f"Could not read browser cookies for {site}, replaying {cookie_file}: {e}")
+            with tracer.step('cookie_load', site=site, method='webdriver'):
+                load_cookies(driver, url, cookie_file)
+            self._set_status(site, state='replayed', checkedAt=checked_at)
+            return 'replayed'
+        if warm:
+            self._set_status(site, state='warm', checkedAt=checked_at)
+            return 'warm'
+
+        saved = load_json(cookie_file) or []
+        if not self.has_login(saved, site):
+            print(f"Login for {site} has expired; export fresh cookies to {cookie_file}.")
+            tracer.log({'event': 'login_expired', 'site': site, 'cookieFile': cookie_file})
+            self._set_status(site, state='expired', checkedAt=checked_at)
+            raise LoginExpired(f"Login for {site} has expired; export fresh cookies to {cookie_file}.")
+        with tracer.step('cookie_load', site=site, method='cdp', cookies=len(saved)):
+            driver.execute_cdp_cmd('Network.setCookies', {'cookies': [cookie_to_cdp(cookie) for cookie in saved]})
+        self._set_status(site, state='replayed', checkedAt=checked_at)
+        return 'replayed'
+
+    def save_cookies(self, driver, sites):
+        """Write the browser's current cookies for each logged-in site back to its cookie file."""
+        if not sites:
             return
+        cookies = self.browser_cookies(driver)
+        for site in sites:
+            current = [cookie for cookie in cookies if cookie_matches_domain(cookie, site_domain(site))]
+            if not self.has_login(current, site):
+                # Never replace a good cookie file with a logged-out browser's cookies
+                continue
+            cookie_file = COOKIE_SITES[site][1]
+            with self._lock:
+                saved = load_json(cookie_file) or []
+                if sorted(map(self._fingerprint, current)) == sorted(map(self._fingerprint, saved)):
+                    continue
+                if save_json(cookie_file, current):
+                    self._status.setdefault(site, {'site': site})['savedAt'] = datetime.now().isoformat(
+                        timespec='seconds')
+
+    @staticmethod
+    def _fingerprint(cookie):
+        return (cookie.get('domain'), cookie.get('path'), cookie.get('name'), cookie.get('value'),
+                round(cookie.get('expirationDate') or 0))
+
+
+session_state = SessionStateManager()
+
+
+@app.route('/browser-sessions')
+def browser_sessions():
+    return jsonify(session_state.status())
+
+
+# Chrome Driver Pool
+class PooledDriver:
+    def __init__(self, driver, profile=None):
+        self.driver = driver
+        self.profile = profile
+        self.created_at = time.monotonic()
+        self.authenticated_sites = set()
+
+    @property
+    def age(self):
+        return time.monotonic() - self.created_at
+
+    def authenticate(self, site):
+        # Logins only need checking once per browser session
+        if site in self.authenticated_sites:
+            return
+        session_state.ensure_login(self.driver, site)
+        self.authenticated_sites.add(site)
+
+
+class DriverPool:
+    """Bounded set of warm Chrome sessions that tasks check out and return."""
+
+    def __init__(self, size=DRIVER_POOL_SIZE, max_age=DRIVER_MAX_AGE):
+        self.size = size
+        self.max_age = max_age
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _is_healthy(self, pooled):
+        if pooled.age > self.max_age:
+            print(f"Recycling Chrome session after {pooled.age:.0f}s.")
+            return False
+        try:
+            return bool(pooled.driver.window_handles) and pooled.driver.execute_script("return 1;") == 1
+        except Exception as e:
+            print(f"Discarding unhealthy Chrome session: {e}")
+            return False
+
+    def _reset(self, pooled):
+        # Close any extra tabs and park the remaining one on a blank page
+        try:
+            driver = pooled.driver
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+            driver.get("about:blank")
+            return True
+        except Exception as e:
+            print(f"Failed to reset Chrome session: {e}")
+            return False
+
+    @staticmethod
+    def _quit(pooled):
+        try:
+            pooled.driver.quit()
+        except Exception as e:
+            print(f"Error quitting Chrome session: {e}")
+        finally:
+            session_state.release_profile(pooled.profile)
+
+    @staticmethod
+    def _save_cookies(pooled):
+        try:
+            session_state.save_cookies(pooled.driver, pooled.authenticated_sites)
+        except WebDriverException as e:
+            print(f"Could not save cookies from Chrome session: {e}")
+
+    def acquire(self, sites=(), timeout=None):
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("No Chrome session available in the pool.")
+        pooled = None
+        try:
+            while True:
+                with self._lock:
+                    pooled = self._idle.pop() if self._idle else None
+                if pooled is None:
+                    profile = session_state.acquire_profile()
+                    try:
+                        with tracer.step('driver_start', profile=profile):
+                            pooled = PooledDriver(get_chrome_driver(profile), profile)
+                    except Exception:
+                        session_state.release_profile(profile)
+                        raise
+                    break
+                if self._is_healthy(pooled):
+                    break
+                self._quit(pooled)
+            for site in sites:
+                pooled.authenticate(site)
+            return pooled
+        except LoginExpired:
+            # Nothing was loaded into the browser, so it can go back to the pool
+            self.release(pooled)
+            raise
+        except Exception:
+            # A browser that failed to log in is in an unknown state, so don't pool it
+            if pooled is not None:
+                self._quit(pooled)
+            self._slots.release()
+            raise
+
+    def release(self, pooled, discard=False):
+        try:
+            if not discard:
+                self._save_cookies(pooled)
+            if discard or not self._reset(pooled):
+                self._quit(pooled)
+            else:
+                with self._lock:
+                    self._idle.append(pooled)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def session(self, *sites, timeout=None):
+        pooled = self.acquire(sites, timeout=timeout)
+        discard = False
+        try:
+            yield pooled.driver
+        except WebDriverException:
+            discard = True
+            raise
+        except Exception:
+            # Task errors (a slot that isn't free, bad input) leave the browser usable
+            raise
+        except BaseException:
+            discard = True
+            raise
+        finally:
+            self.release(pooled, discard=discard)
+
+    def warm(self, count=1, sites=()):
+        # Hold several sessions at once so each one is a distinct browser
+        warmed = []
+        try:
+            for _ in range(min(count, self.size)):
+                warmed.append(self.acquire(sites))
+        finally:
+            for pooled in warmed:
+                self.release(pooled)
+        print(f"Warmed {len(warmed)} Chrome session(s).")
+
+    def shutdown(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            self._quit(pooled)
+
+
+driver_pool = DriverPool()
+atexit.register(driver_pool.shutdown)
+
+
+# Adaptive Waits
+class StepTimeout(TimeoutException):
+    """A step took longer than its expected latency."""
+
+
+class StepTimings:
+    """Recent wait durations per step, used to learn how long each step should be allowed to take.
+
+    Durations are kept in memory and persisted to the history store so learned timeouts survive restarts.
+    Only successful waits feed the percentile; misses are counted but would only record the timeout itself.
+    """
+
+    def __init__(self, store=None, history=WAIT_HISTORY):
+        self.store = store
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._misses = {}
+        self._history = history
+        if store is not None:
+            for step, seconds, ok in store.recent_step_timings(history):
+                self._remember(step, seconds, ok)
+
+    def _remember(self, step, seconds, ok):
+        if ok:
+            self._durations.setdefault(step, deque(maxlen=self._history)).append(seconds)
+        else:
+            self._misses[step] = self._misses.get(step, 0) + 1
+
+    def record(self, step, seconds, ok):
+        with self._lock:
+            self._remember(step, seconds, ok)
+        if self.store is not None:
+            try:
+                self.store.record_step_timing(step, seconds, ok)
+            except sqlite3.Error as e:
+                print(f"Could not persist timing for {step}: {e}")
+
+    def percentile(self, step, fraction):
+        with self._lock:
+            durations = sorted(self._durations.get(step, ()))
+        if not durations:
+            return None
+        return durations[min(len(durations) - 1, int(len(durations) * fraction))]
+
+    def timeout(self, step):
+        with self._lock:
+            samples = len(self._durations.get(step, ()))
+        if samples < WAIT_MIN_SAMPLES:
+            return WAIT_DEFAULT_TIMEOUT
+        return min(WAIT_MAX_TIMEOUT, max(WAIT_MIN_TIMEOUT, self.percentile(step, 0.95) * WAIT_MARGIN))
+
+    def summary(self):
+        with self._lock:
+            steps = sorted(set(self._durations) | set(self._misses))
+            counts = {step: len(self._durations.get(step, ())) for step in steps}
+            misses = dict(self._misses)
+        return [{
+            'step': step,
+            'samples': counts[step],
+            'misses': misses.get(step, 0),
+            'p50': self.percentile(step, 0.5),
+            'p95': self.percentile(step, 0.95),
+            'timeout': self.timeout(step),
+        } for step in steps]
+
+
+step_timings = StepTimings(config_store)
+
+
+class AdaptiveWait:
+    """WebDriverWait replacement whose timeout comes from each step's recorded latency.
+
+    `until(condition, step)` polls every WAIT_POLL_INTERVAL, records how long the step took and raises
+    StepTimeout as soon as the step overruns its learned budget (or the overall deadline, if given).
+    """
+
+    def __init__(self, driver, deadline=None, timings=None):
+        self.driver = driver
+        self.deadline = deadline
+        self.timings = timings or step_timings
+
+    def until(self, condition, step, timeout=None):
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        timeout = timeout or self.timings.timeout(step)
+        if self.deadline is not None:
+            timeout = min(timeout, max(0.1, self.deadline - time.monotonic()))
+        started = time.monotonic()
+        try:
+            result = WebDriverWait(self.driver, timeout, poll_frequency=WAIT_POLL_INTERVAL).until(condition)
+        except TimeoutException as e:
+            elapsed = time.monotonic() - started
+            self.timings.record(step, elapsed, False)
+            tracer.record_wait(step, elapsed, False)
+            print(f"Wait for {step} gave up after {elapsed:.2f}s (budget {timeout:.2f}s).")
+            raise StepTimeout(f"{step} did not complete within {timeout:.1f}s") from e
+        elapsed = time.monotonic() - started
+        self.timings.record(step, elapsed, True)
+        tracer.record_wait(step, elapsed, True)
+        return result
+
+
+@app.route('/waits')
+def wait_stats():
+    return jsonify(step_timings.summary())
+
+
+# PBA HTTP Client
+class PbaClientError(Exception):
+    pass
+
+
+class PbaNotConfigured(PbaClientError):
+    pass
+
+
+class SchemaHTMLParser(HTMLParser):
+    """Collect lanes from schema HTML in the same shape SCHEMA_GRID_SCRIPT returns."""
+
+    def __init__(self):
+        super().__init__()
+        self.lanes = []
+        self._in_div_hour = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'tr' and (attrs.get('class') or '').startswith('trSchemaLane_'):
+            hidden = 'display:none' in (attrs.get('style') or '').replace(' ', '')
+            self.lanes.append({'name': attrs['class'], 'displayed': not hidden, 'titles': []})
+        elif tag == 'div' and attrs.get('class') == 'divHour':
+            self._in_div_hour = True
+        elif tag == 'a' and self._in_div_hour and self.lanes:
+            self.lanes[-1]['titles'].append(attrs.get('title') or '')
+
+    def handle_endtag(self, tag):
+        if tag == 'div':
+            self._in_div_hour = False
+
+
+class CreditOptionsParser(HTMLParser):
+    """Collect the options of the paymentCreditSelect dropdown on the credit list page.
+
+    Also sums the last column of the creditList table into balance, which stays None without that table.
+    """
+
+    price_pattern = re.compile(r'Price: \$([\d.]+)')
+    amount_pattern = re.compile(r'\$\s*([\d,]+(?:\.\d+)?)')
+
+    def __init__(self):
+        super().__init__()
+        self.found_select = False
+        self.options = []
+        self.balance = None
+        self._in_select = False
+        self._option = None
+        self._in_credit_list = False
+        self._row = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'select' and 'paymentCreditSelect' in (attrs.get('class') or '').split():
+            self.found_select = self._in_select = True
+        elif tag == 'option' and self._in_select:
+            self._option = {'value': attrs.get('value', ''), 'text': ''}
+        elif tag == 'table' and 'creditList' in (attrs.get('class') or '').split():
+            self._in_credit_list = True
+            self.balance = 0.0
+        elif tag == 'tr' and self._in_credit_list:
+            self._row = []
+        elif tag == 'td' and self._row is not None:
+            self._cell = ''
+
+    def handle_data(self, data):
+        if self._option is not None:
+            self._option['text'] += data
+        elif self._cell is not None:
+            self._cell += data
+
+    def handle_endtag(self, tag):
+        if tag == 'option' and self._option is not None:
+            self._close_option()
+        elif tag == 'select':
+            if self._option is not None:
+                self._close_option()
+            self._in_select = False
+        elif tag == 'td' and self._cell is not None:
+            self._row.append(self._cell)
+            self._cell = None
+        elif tag == 'tr' and self._row is not None:
+            match = self.amount_pattern.search(self._row[-1]) if self._row else None
+            if match:
+                self.balance = round(self.balance + float(match.group(1).replace(',', '')), 2)
+            self._row = None
+        elif tag == 'table' and self._in_credit_list:
+            self._in_credit_list = False
+
+    def _close_option(self):
+        option, self._option = self._option, None
+        option['text'] = ' '.join(option['text'].split())
+        match = self.price_pattern.search(option['text'])
+        option['price'] = float(match.group(1)) if match else None
+        self.options.append(option)
+
+
+def parse_schema_html(html):
+    parser = SchemaHTMLParser()
+    parser.feed(html)
+    return parser.lanes
+
+
+def parse_credit_account(html):
+    """Return (options, balance) from the credit list page; balance is None if the page doesn't show it."""
+    parser = CreditOptionsParser()
+    parser.feed(html)
+    if not parser.found_select:
+        raise PbaClientError("Credit list not found; the PBA session may have expired.")
+    return parser.options, parser.balance
+
+
+def parse_credit_options(html):
+    return parse_credit_account(html)[0]
+
+
+class PbaClient:
+    """Read-only access to PBA pages over a pooled HTTP session that reuses the browser cookies."""
+
+    def __init__(self, base_url=PBA_BASE_URL, cookie_file="pba_cookies.json", timeout=PBA_HTTP_TIMEOUT,
+                 schema_paths=None):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.schema_paths = PBA_SCHEMA_PATHS if schema_paths is None else schema_paths
+        self.session = requests.Session()
+        retry = Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504), allowed_methods=('GET',))
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = (
+            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36")
+        self.load_cookies(cookie_file)
+
+    def load_cookies(self, cookie_file):
+        cookies = load_json(cookie_file) or []
         for cookie in cookies:
-            cookie['domain'] = cookie.get('domain', '').lstrip('.')
-            if 'sameSite' in cookie and cookie['sameSite'] not in ["Strict", "Lax", "None"]:
-                del cookie['sameSite']
+            self.session.cookies.set(cookie['name'], cookie['value'],
+                                     domain=cookie.get('domain', '').lstrip('.') or None,
+                                     path=cookie.get('path', '/'))
+        print(f"Loaded {len(cookies)} cookies from {cookie_file} into the PBA HTTP session.")
+
+    def get(self, path):
+        import requests
+
+        try:
+            response = self.session.get(self.base_url + path, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise PbaClientError(f"GET {path} failed: {e}") from e
+        if 'charset' not in response.headers.get('Content-Type', '').lower():
+            # requests would assume ISO-8859-1 and garble the en dash in block titles
+            response.encoding = 'utf-8'
+        return response.text
+
+    def fetch_schema(self, court_location, court_type, booking_date):
+        path = (self.schema_paths.get((court_location, court_type or None))
+                or self.schema_paths.get((court_location, None)))
+        if not path:
+            court = f"{court_location} {court_type}" if court_type else court_location
+            raise PbaNotConfigured(f"No schema path is configured for {court}.")
+        return parse_schema_html(self.get(path.format(date=booking_date.strftime("%Y-%m-%d"))))
+
+    def fetch_availability(self, court_location, court_type, booking_date):
+        """Return [{minutes: block_index}] of available blocks per lane, ready for plan_timeslot."""
+        return parse_schema_grid(self.fetch_schema(court_location, court_type, booking_date))
+
+    def fetch_credit_account(self):
+        return parse_credit_account(self.get(PBA_CREDIT_LIST_PATH))
+
+    def fetch_credit_options(self):
+        return self.fetch_credit_account()[0]
+
+
+_pba_client = None
+_pba_client_lock = threading.Lock()
+
+
+def get_pba_client():
+    global _pba_client
+    with _pba_client_lock:
+        if _pba_client is None:
+            _pba_client = PbaClient()
+        return _pba_client
+
+
+def free_slots(grid):
+    """Summarise an availability grid as {lane: ['HH:MM', ...]} of free 30-minute starts."""
+    return {lane: [f"{minutes // 60:02d}:{minutes % 60:02d}" for minutes in sorted(free)]
+            for lane, free in enumerate(grid) if free}
+
+
+# Availability Cache
+class AvailabilityCache:
+    """Availability grids keyed by (location, courtType, date), refetched over HTTP once older than the TTL.
+
+    The grids are cached per process, but with a store invalidate() stamps the key in history.db and
+    every worker treats grids fetched before the stamp as stale, so a booking shows up everywhere at once.
+    """
+
+    def __init__(self, ttl=AVAILABILITY_TTL, store=None):
+        self.ttl = ttl
+        self.store = store
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(court_location, court_type, booking_date):
+        return court_location, court_type or None, booking_date.strftime("%Y-%m-%d")
+
+    def _is_fresh(self, key, fetched_at):
+        if time.time() - fetched_at >= self.ttl:
+            return False
+        return self.store is None or self.store.availability_invalidated_at(*key) < fetched_at
+
+    def get(self, court_location, court_type, booking_date):
+        """Return (grid, cached) for the court and date."""
+        key = self._key(court_location, court_type, booking_date)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and self._is_fresh(key, entry[0]):
+            return entry[1], True
+        # Stamp the grid with when the fetch started, so a booking made while it was in flight outdates it
+        fetched_at = time.time()
+        grid = get_pba_client().fetch_availability(court_location, court_type, booking_date)
+        with self._lock:
+            self._entries[key] = (fetched_at, grid)
+        return grid, False
+
+    def invalidate(self, court_location=None, court_type=None, booking_date=None):
+        key = None if court_location is None else self._key(court_location, court_type, booking_date)
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+        if self.store is not None:
             try:
-                driver.add_cookie(cookie)
-            except Exception as e:
-                print(f"Error adding cookie: {e}")
-        driver.refresh()
-        print(f"Loaded cookies from {cookie_file} and refreshed {url}.")
-    except Exception as e:
-        print(f"Error loading cookies from {cookie_file}: {e}")
+                self.store.invalidate_availability(*(key or ()), prune_before=time.time() - self.ttl)
+            except sqlite3.Error as e:
+                print(f"Error sharing availability invalidation: {e}")
+
+
+availability_cache = AvailabilityCache(store=config_store)
+
+
+def get_week_availability(starting_week, court_location, court_type=None):
+    courts = [court for court in PBA_COURTS
+              if court[0] == court_location and (not court_type or court[1] in (court_type, None))]
+    if not courts:
+        raise ValueError("Invalid court location or type provided.")
+    if not any(court in PBA_SCHEMA_PATHS or (court[0], None) in PBA_SCHEMA_PATHS for court in courts):
+        raise PbaNotConfigured(f"Availability is not configured for {court_location}: set PBA_SCHEMA_PATHS to the "
+                               f"schema request its booking tabs make.")
+    dates = [(day, get_booking_date(starting_week, day)) for day in DAY_OF_WEEK_MAPPING]
+
+    def fetch(court, day, booking_date):
+        entry = {'courtLocation': court[0], 'courtType': court[1], 'dayOfWeek': day,
+                 'date': booking_date.strftime("%Y-%m-%d")}
+        try:
+            grid, entry['cached'] = availability_cache.get(court[0], court[1], booking_date)
+            entry['freeSlots'] = free_slots(grid)
+        except PbaClientError as e:
+            entry['error'] = str(e)
+        return entry
+
+    # Cache misses are independent page fetches, so run them side by side on the pooled session
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        return list(executor.map(lambda args: fetch(*args),
+                                 [(court, day, booking_date) for court in courts for day, booking_date in dates]))
+
+
+@app.route('/availability')
+def availability():
+    week = request.args.get('week')
+    court_location = request.args.get('location')
+    if not week or not court_location:
+        return jsonify({'error': 'week and location are required.'}), 400
+    try:
+        datetime.strptime(week, "%Y-%m-%d")
+        days = get_week_availability(week, court_location, request.args.get('courtType'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except PbaNotConfigured as e:
+        return jsonify({'error': str(e)}), 503
+    errors = [day['error'] for day in days if 'error' in day]
+    if errors and len(errors) == len(days):
+        # Nothing could be fetched (e.g. the PBA session expired), so don't answer with an empty week
+        return jsonify({'error': f"Could not fetch availability: {errors[0]}", 'availability': days}), 502
+    return jsonify({'weekStarting': week, 'location': court_location, 'availability': days})
 
 
 # Selenium Tasks
-def selenium_buy_credits_task(credits_list):
-    driver = get_chrome_driver()
+def read_credit_account():
+    """Return ({amount: dropdown value}, current balance) over HTTP; either is None if it can't be read."""
     try:
-        # Load necessary cookies
-        load_cookies(driver, "https://www.google.com", "google_cookies.json")
-        load_cookies(driver, "https://www.paypal.com.au", "paypal_cookies.json")
-        load_cookies(driver, "https://pba.yepbooking.com.au", "pba_cookies.json")
+        options, balance = get_pba_client().fetch_credit_account()
+    except PbaClientError as e:
+        print(f"Could not read the credit list over HTTP: {e}")
+        return None, None
+    return {option['price']: option['value'] for option in options if option['price'] is not None}, balance
+
+
+class PaymentUncertain(Exception):
+    """The purchase failed after PayPal was submitted, so it may have gone through."""
+
+
+def purchase_credit(driver, amount, option_value, deadline):
+    from selenium.webdriver.support.ui import Select
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+
+    wait = AdaptiveWait(driver, deadline=deadline)
+
+    # Navigate to the credit list page
+    with tracer.step('navigation', url=PBA_BASE_URL + PBA_CREDIT_LIST_PATH):
+        driver.get(PBA_BASE_URL + PBA_CREDIT_LIST_PATH)
+
+    # Locate and interact with the payment credit dropdown
+    select = Select(wait.until(EC.presence_of_element_located((By.CLASS_NAME, "paymentCreditSelect")),
+                               'credit_list'))
+    if option_value is None:
+        # Find the option that matches the credit amount
+        option_value = next(
+            (
+                option.get_attribute('value') for option in select.options
+                if (match := CreditOptionsParser.price_pattern.search(option.text)) and float(match.group(1)) == amount
+            ),
+            None
+        )
+        if option_value is None:
+            raise ValueError(f"No credit option for ${amount:.2f}.")
+    select.select_by_value(option_value)
+
+    # Proceed with the payment steps
+    wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "a.paymentCreditLink[title='Top up credit']")),
+               'credit_top_up').click()
+    wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "input.paymentTypeCheck[type='radio'][value='PAYPAL']")),
+               'credit_payment_type').click()
+    wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "a.paymentButton[title='Pay now']")),
+               'credit_pay_now').click()
+
+    # Complete the purchase on PayPal
+    with tracer.step('payment', amount=amount):
+        wait.until(EC.element_to_be_clickable((By.ID, "payment-submit-btn")), 'paypal_submit').click()
+        try:
+            wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "button.donepage-return-to-merchant-button")),
+                       'paypal_return').click()
+        except Exception as e:
+            raise PaymentUncertain(f"PayPal was submitted but the return to PBA failed: {e}") from e
+
+
+class CreditPurchaseExecutor:
+    """Buy credits concurrently, each purchase in its own pooled browser, and keep a ledger of outcomes.
+
+    Purchases reserve their amount against target_total (the credit still to buy) before starting, and
+    none starts once the reservations reach it, so retries and parallel workers stop as soon as the
+    target is met. Payments that may have gone through are never retried.
+    """
+
+    def __init__(self, parallelism=CREDIT_PURCHASE_PARALLELISM, timeout=CREDIT_PURCHASE_TIMEOUT,
+                 retries=CREDIT_PURCHASE_RETRIES, backoff=CREDIT_PURCHASE_BACKOFF):
+        self.parallelism = max(1, parallelism)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._lock = threading.Lock()
+        self._committed = 0.0
+
+    def run(self, credits_list, option_values=None, target_total=None):
+        self._committed = 0.0
+        requested_total = sum(credit['amount'] for credit in credits_list)
+        target_total = requested_total if target_total is None else target_total
+        option_values = option_values or {}
+
+        with ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix='credit') as executor:
+            entries = list(executor.map(
+                lambda item: self._purchase(item[0], item[1]['amount'], option_values.get(item[1]['amount']),
+                                            target_total),
+                enumerate(credits_list)))
+
+        purchased = [entry['amount'] for entry in entries if entry['status'] == 'purchased']
+        return {
+            'targetTotal': target_total,
+            'purchasedTotal': round(sum(purchased), 2),
+            'purchased': purchased,
+            'failed': [entry for entry in entries if entry['status'] != 'purchased'],
+            'ledger': entries,
+        }
 
-        # Pre-compile the regex pattern for efficiency
-        price_pattern = re.compile(r'Price: \$([\d.]+)')
+    def _purchase(self, index, amount, option_value, target_total):
+        entry = {'index': index, 'amount': amount, 'status': 'pending', 'attempts': 0, 'seconds': None, 'error': None}
+        started = time.monotonic()
+        try:
+            for attempt in range(self.retries + 1):
+                with self._lock:
+                    if self._committed >= target_total - 0.005:
+                        entry['status'] = 'skipped'
+                        entry['error'] = "Target credit balance already reached."
+                        return entry
+                    self._committed += amount
+
+                entry['attempts'] += 1
+                deadline = time.monotonic() + self.timeout
+                try:
+                    with driver_pool.session("google", "paypal", "pba", timeout=self.timeout) as driver:
+                        purchase_credit(driver, amount, option_value, deadline)
+                    entry['status'] = 'purchased'
+                    entry['error'] = None
+                    print(f"Bought ${amount:.2f} credit (attempt {entry['attempts']}).")
+                    return entry
+                except PaymentUncertain as e:
+                    # Keep the reservation; buying again could double-charge
+                    entry['status'] = 'uncertain'
+                    entry['error'] = str(e)
+                    print(f"Purchase of ${amount:.2f} credit is uncertain: {e}")
+                    return entry
+                except Exception as e:
+                    with self._lock:
+                        self._committed -= amount
+                    entry['error'] = f"{type(e).__name__}: {e}"
+                    print(f"Failed to buy ${amount:.2f} credit (attempt {entry['attempts']}): {e}")
+                    if isinstance(e, (ValueError, LoginExpired)) or attempt == self.retries:
+                        break
+                    time.sleep(self.backoff * 2 ** attempt)
+            entry['status'] = 'failed'
+            return entry
+        finally:
+            entry['seconds'] = round(time.monotonic() - started, 3)
+
+
+def selenium_buy_credits_task(credits_list, target_balance=None):
+    """Buy from credits_list until the account holds target_balance (by default, the total requested).
+
+    Credit already on the account counts towards the target, so re-running a partly failed purchase
+    only buys what is still missing.
+    """
+    option_values, balance = read_credit_account()
+    if option_values is not None:
+        missing = sorted({credit['amount'] for credit in credits_list} - set(option_values))
+        if missing:
+            raise ValueError(f"No credit option for amount(s): {missing}")
+
+    requested_total = round(sum(credit['amount'] for credit in credits_list), 2)
+    target_balance = requested_total if target_balance is None else target_balance
+    if balance is None:
+        print("Current credit balance unknown; buying everything requested.")
+        target_total = requested_total
+    else:
+        target_total = round(max(0.0, target_balance - balance), 2)
+        print(f"Credit balance ${balance:.2f}, target ${target_balance:.2f}: buying up to ${target_total:.2f}.")
 
-        for idx, credit in enumerate(credits_list):
-            # Open a new tab for each credit after the first one
-            if idx > 0:
-                driver.execute_script("window.open('');")
+    ledger = CreditPurchaseExecutor().run(credits_list, option_values, target_total)
+    ledger.update(startingBalance=balance, targetBalance=target_balance)
+    if credits_list and target_total > 0 and not ledger['purchased']:
+        raise RuntimeError(f"No credits were purchased: {ledger['failed']}")
+    return ledger
 
-            # Switch to the current tab
-            driver.switch_to.window(driver.window_handles[idx])
-            wait = WebDriverWait(driver, 60)
 
-            try:
-                # Navigate to the credit list page
-                driver.get("https://pba.yepbooking.com.au/user.php?tab=credit-list")
-
-                # Locate and interact with the payment credit dropdown
-                dropdown = wait.until(EC.presence_of_element_located((By.CLASS_NAME, "paymentCreditSelect")))
-                select = Select(dropdown)
-
-                # Find the option that matches the credit amount
-                selected_option = next(
-                    (
-                        option for option in select.options
-                        if (match := price_pattern.search(option.text)) and float(match.group(1)) == credit['amount']
-                    ),
-                    None
-                )
-
-                if selected_option:
-                    select.select_by_value(selected_option.get_attribute('value'))
-                else:
-                    # Skip to the next credit if no matching option is found
-                    continue
+COURT_BUTTON_IDS = {
+    ("PBA Canningvale", "Hebat Court"): "ui-id-11",
+    ("PBA Canningvale", "Super Court"): "ui-id-9",
+    ("PBA Malaga", None): "ui-id-1"
+}
 
-                # Proceed with the payment steps
-                wait.until(
-                    EC.element_to_be_clickable((By.CSS_SELECTOR, "a.paymentCreditLink[title='Top up credit']"))).click()
-                wait.until(EC.element_to_be_clickable(
-                    (By.CSS_SELECTOR, "input.paymentTypeCheck[type='radio'][value='PAYPAL']"))).click()
-                wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "a.paymentButton[title='Pay now']"))).click()
 
-                # Load PayPal cookies and complete the purchase
-                wait.until(EC.element_to_be_clickable((By.ID, "payment-submit-btn"))).click()
-                wait.until(
-                    EC.element_to_be_clickable((By.CSS_SELECTOR, "button.donepage-return-to-merchant-button"))).click()
+def get_court_button_id(court_location, court_type):
+    button_id = COURT_BUTTON_IDS.get((court_location, court_type or None)) or COURT_BUTTON_IDS.get((court_location, None))
+    if not button_id:
+        raise ValueError("Invalid court location or type provided.")
+    return button_id
 
-            except Exception:
-                # Handle exceptions for the current tab and continue with the next
-                continue
 
-        # Keep the browser open for manual inspection after processing all credits
-        while True:
-            time.sleep(5000)
-    finally:
-        # Ensure the browser is closed upon completion or error
-        driver.quit()
+def select_court(wait, court_location, court_type):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
 
+    with tracer.step('select_court', courtLocation=court_location, courtType=court_type):
+        wait.until(EC.element_to_be_clickable((By.ID, get_court_button_id(court_location, court_type))),
+                   'select_court').click()
 
-def selenium_book_court_task(starting_week, day_of_week, court_location, court_type, session_start, session_end):
-    driver = get_chrome_driver()
+
+# Jump the jQuery UI datepicker straight to a date; returns the month now displayed, or null if unavailable
+DATEPICKER_SET_DATE_SCRIPT = """
+const [year, month, day] = arguments;
+const $ = window.jQuery;
+if (!$ || !$.fn || !$.fn.datepicker) return null;
+const picker = $('.hasDatepicker').first();
+if (!picker.length) return null;
+picker.datepicker('setDate', new Date(year, month, day));
+return $('.ui-datepicker-month').first().text() + ' ' + $('.ui-datepicker-year').first().text();
+"""
+
+
+def jump_to_month(driver, booking_date):
     try:
-        load_cookies(driver, "https://www.google.com", "google_cookies.json")
-        load_cookies(driver, "https://pba.yepbooking.com.au", "pba_cookies.json")
-
-        wait = WebDriverWait(driver, 60)
-        court_button_ids = {
-            ("PBA Canningvale", "Hebat Court"): "ui-id-11",
-            ("PBA Canningvale", "Super Court"): "ui-id-9",
-            ("PBA Malaga", None): "ui-id-1"
-        }
-        button_id = court_button_ids.get((court_location, court_type)) or court_button_ids.get((court_location, None))
-        if not button_id:
-            raise ValueError("Invalid court location or type provided.")
-        wait.until(EC.element_to_be_clickable((By.ID, button_id))).click()
+        displayed = driver.execute_script(
+            DATEPICKER_SET_DATE_SCRIPT, booking_date.year, booking_date.month - 1, booking_date.day)
+    except WebDriverException as e:
+        print(f"Datepicker setDate failed: {e}")
+        return False
+    return displayed == booking_date.strftime("%B %Y")
+
+
+def step_to_month(wait, booking_date):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+
+    # Fallback: click through months, waiting only for the calendar to re-render
+    target_month_year = booking_date.strftime("%B %Y")
+    while True:
+        displayed_month_element = wait.until(EC.presence_of_element_located((By.CLASS_NAME, "ui-datepicker-month")),
+                                             'datepicker_month')
+        displayed_year_element = wait.until(EC.presence_of_element_located((By.CLASS_NAME, "ui-datepicker-year")),
+                                            'datepicker_year')
+        displayed_month = displayed_month_element.text
+        displayed_year = displayed_year_element.text
+        current_display = f"{displayed_month} {displayed_year}"
+        if current_display == target_month_year:
+            break
+        elif datetime.strptime(current_display, "%B %Y") < booking_date:
+            wait.until(EC.element_to_be_clickable((By.CLASS_NAME, "ui-datepicker-next")), 'datepicker_next').click()
+        else:
+            wait.until(EC.element_to_be_clickable((By.CLASS_NAME, "ui-datepicker-prev")), 'datepicker_prev').click()
+        # Wait for the calendar to update
+        wait.until(EC.staleness_of(displayed_month_element), 'datepicker_redraw')
+
 
-        starting_date = datetime.strptime(starting_week, "%Y-%m-%d")
-        booking_date = starting_date + timedelta(days=DAY_OF_WEEK_MAPPING[day_of_week])
+def select_booking_date(driver, wait, booking_date):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
 
+    with tracer.step('datepicker', date=booking_date.date().isoformat()):
         # Navigate to the correct month and year on the calendar
-        target_month_year = booking_date.strftime("%B %Y")
-        while True:
-            displayed_month_element = wait.until(EC.presence_of_element_located((By.CLASS_NAME, "ui-datepicker-month")))
-            displayed_year_element = wait.until(EC.presence_of_element_located((By.CLASS_NAME, "ui-datepicker-year")))
-            displayed_month = displayed_month_element.text
-            displayed_year = displayed_year_element.text
-            current_display = f"{displayed_month} {displayed_year}"
-            if current_display == target_month_year:
-                break
-            elif datetime.strptime(current_display, "%B %Y") < booking_date:
-                wait.until(EC.element_to_be_clickable((By.CLASS_NAME, "ui-datepicker-next"))).click()
-            else:
-                wait.until(EC.element_to_be_clickable((By.CLASS_NAME, "ui-datepicker-prev"))).click()
-            # Wait for the calendar to update
-            time.sleep(1)  # Allow calendar to update
-            wait.until(EC.staleness_of(displayed_month_element))
+        wait.until(EC.presence_of_element_located((By.CLASS_NAME, "ui-datepicker-month")), 'datepicker_ready')
+        if not jump_to_month(driver, booking_date):
+            print("Falling back to stepping through the datepicker.")
+            step_to_month(wait, booking_date)
 
         # Select the booking day
         target_day = booking_date.day
+        day_element = wait.until(
+            EC.element_to_be_clickable((By.XPATH, f"//td[@data-handler='selectDay']/a[text()='{target_day}']")),
+            'datepicker_day')
+        day_element.click()
+
+
+SLOT_MINUTES = 30
+BLOCK_TIME_PATTERN = re.compile(r'^(\d{1,2}):(\d{2})\s*([AP]M)$', re.IGNORECASE)
+
+# Pull every lane of the schema in one round trip instead of querying rows and blocks one by one
+SCHEMA_GRID_SCRIPT = """
+const rows = document.querySelectorAll(".schemaWrapper tr[class^='trSchemaLane_']");
+return Array.from(rows).map(row => ({
+    name: row.className,
+    displayed: row.getClientRects().length > 0 && getComputedStyle(row).visibility !== 'hidden',
+    titles: Array.from(row.querySelectorAll("td > div[class='divHour'] > a")).map(a => a.getAttribute('title') || '')
+}));
+"""
+SCHEMA_BLOCKS_SCRIPT = """
+const rows = document.querySelectorAll(".schemaWrapper tr[class^='trSchemaLane_']");
+return arguments[0].map(([lane, block]) => rows[lane].querySelectorAll("td > div[class='divHour'] > a")[block]);
+"""
+
+
+def parse_block_minutes(title):
+    """Return the start of an available block as minutes past midnight, or None."""
+    if "Available" not in title:
+        return None
+    match = BLOCK_TIME_PATTERN.match(title.split('–')[0].strip())
+    if not match:
+        return None
+    hour, minute, period = int(match.group(1)), int(match.group(2)), match.group(3).upper()
+    if not 1 <= hour <= 12 or minute > 59:
+        return None
+    return (hour % 12 + (12 if period == 'PM' else 0)) * 60 + minute
+
+
+def parse_schema_grid(lanes):
+    """Turn scraped lanes into [{minutes: block_index}] of available blocks, one dict per lane."""
+    grid = []
+    for lane in lanes:
+        free = {}
+        if lane.get('displayed', True):
+            for block_index, title in enumerate(lane['titles']):
+                minutes = parse_block_minutes(title)
+                if minutes is not None:
+                    free.setdefault(minutes, block_index)
+        grid.append(free)
+    return grid
+
+
+def plan_timeslot(grid, session_start, session_end):
+    """Choose (lane, block_index) pairs covering the session in 30-minute steps.
+
+    A single lane covering the whole session is preferred; otherwise each step stays on the
+    current lane when it can and moves to the first free lane when it can't. Returns None when
+    some step has no free block in any lane.
+    """
+    start = datetime.strptime(session_start, '%H:%M')
+    end = datetime.strptime(session_end, '%H:%M')
+    steps = range(start.hour * 60 + start.minute, end.hour * 60 + end.minute, SLOT_MINUTES)
+    if not steps:
+        return None
+
+    for lane, free in enumerate(grid):
+        if all(minutes in free for minutes in steps):
+            return [(lane, free[minutes]) for minutes in steps]
+
+    plan = []
+    current = None
+    for minutes in steps:
+        if current is None or minutes not in grid[current]:
+            current = next((lane for lane, free in enumerate(grid) if minutes in free), None)
+            if current is None:
+                return None
+        plan.append((current, grid[current][minutes]))
+    return plan
+
+
+class SchemaReloadTimeout(Exception):
+    """The booking went through, but the page never replaced the schema afterwards."""
+
+
+def book_timeslot(driver, wait, session_start, session_end, await_reload=False):
+    """Select the blocks covering the session on the open schema and confirm the booking.
+
+    Returns True if the booking was submitted, False if the slot isn't free. With await_reload, also waits
+    for the page to replace the schema after booking (raising SchemaReloadTimeout if it doesn't), so the next
+    scan never reads blocks from before the booking.
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+
+    with tracer.step('slot_scan', sessionStart=session_start, sessionEnd=session_end):
+        wait.until(EC.presence_of_element_located((By.CLASS_NAME, 'schemaWrapper')), 'schema_ready')
+        plan = plan_timeslot(parse_schema_grid(driver.execute_script(SCHEMA_GRID_SCRIPT)), session_start,
+                             session_end)
+    if not plan:
+        return False
+
+    with tracer.step('slot_click', blocks=len(plan)):
+        for block in driver.execute_script(SCHEMA_BLOCKS_SCRIPT, plan):
+            if not click_element_with_retry(driver, block):
+                raise RuntimeError("Could not select every block of the session.")
+
+    # Proceed with booking
+    with tracer.step('booking_submit'):
+        continue_button = wait.until(EC.element_to_be_clickable(
+            (By.XPATH, "//a[contains(@class, 'showRecapDialog') and contains(@title, 'Continue')]")),
+            'booking_continue')
+        continue_button.click()
+
+        book_button = wait.until(EC.element_to_be_clickable(
+            (By.XPATH, "//a[contains(@class, 'ui-state-default') and contains(text(), 'Book')]")), 'booking_confirm')
+        old_schema = driver.find_element(By.CLASS_NAME, 'schemaWrapper')
+        book_button.click()
+    if await_reload:
+        # The old wrapper stays in the DOM until the reload lands, so wait for it to go rather than for presence
         try:
-            day_element = wait.until(
-                EC.element_to_be_clickable((By.XPATH, f"//td[@data-handler='selectDay']/a[text()='{target_day}']")))
-            day_element.click()
-        except Exception:
-            return
+            wait.until(EC.staleness_of(old_schema), 'schema_reload')
+        except TimeoutException as e:
+            raise SchemaReloadTimeout("The booking was submitted but the schema did not reload.") from e
+    return True
+
+
+def selenium_book_court_task(starting_week, day_of_week, court_location, court_type, session_start, session_end):
+    with driver_pool.session("google", "pba") as driver:
+        wait = AdaptiveWait(driver)
+        select_court(wait, court_location, court_type)
+        booking_date = get_booking_date(starting_week, day_of_week)
+        select_booking_date(driver, wait, booking_date)
 
         # Timeblock selection
+        booked = book_timeslot(driver, wait, session_start, session_end)
+    # Raised outside the pool session so a healthy browser goes back to the pool
+    if not booked:
+        raise RuntimeError("The session is not free on any lane.")
+    availability_cache.invalidate(court_location, court_type, booking_date)
+    return "Booking submitted."
+
+
+def group_sessions_for_booking(starting_week, sessions):
+    """Group bookable sessions by court and date so each court tab and date is opened once.
+
+    Returns ({(court_location, court_type): {booking_date: [(index, session), ...]}}, skipped_results).
+    """
+    groups = {}
+    skipped = []
+    for index, session in enumerate(sessions):
+        if session.get('statusBooked'):
+            skipped.append(_booking_result(index, session, "skipped", "Already booked."))
+            continue
         try:
-            schema_wrapper = wait.until(EC.presence_of_element_located((By.CLASS_NAME, 'schemaWrapper')))
-
-            desired_start = datetime.strptime(session_start, '%H:%M')
-            desired_end = datetime.strptime(session_end, '%H:%M')
+            court_key = (session['courtLocation'], session.get('courtType') or None)
+            get_court_button_id(*court_key)
+            booking_date = get_booking_date(starting_week, session['dayOfWeek'])
+            datetime.strptime(session['sessionStart'], '%H:%M')
+            datetime.strptime(session['sessionEnd'], '%H:%M')
+        except (KeyError, ValueError) as e:
+            skipped.append(_booking_result(index, session, "skipped", f"Cannot book this session: {e}"))
+            continue
+        groups.setdefault(court_key, {}).setdefault(booking_date, []).append((index, session))
+    return groups, skipped
+
+
+def _booking_result(index, session, status, detail):
+    return {
+        'index': index,
+        'studentName': session.get('studentName'),
+        'dayOfWeek': session.get('dayOfWeek'),
+        'courtLocation': session.get('courtLocation'),
+        'courtType': session.get('courtType'),
+        'sessionStart': session.get('sessionStart'),
+        'sessionEnd': session.get('sessionEnd'),
+        'status': status,
+        'detail': detail,
+    }
 
-            booking_successful = False
-            rows = schema_wrapper.find_elements(By.XPATH, ".//tr[starts-with(@class, 'trSchemaLane_')]")
 
-            for row in rows:
-                try:
-                    if not row.is_displayed():
-                        continue
-
-                    time_blocks = row.find_elements(By.XPATH, ".//td/div[@class='divHour']/a")
-
-                    available_blocks = {}
-                    for block in time_blocks:
-                        title = block.get_attribute('title')
-                        if "Available" in title:
-                            try:
-                                block_time_str = title.split('–')[0].strip()
-                                block_time = datetime.strptime(block_time_str, '%I:%M%p')
-                                available_blocks[block_time] = block
-                            except ValueError:
-                                continue
-
-                    blocks_to_click = []
-                    current_time = desired_start
-                    while current_time < desired_end:
-                        block = available_blocks.get(current_time)
-                        if block:
-                            blocks_to_click.append(block)
-                            current_time += timedelta(minutes=30)
+def selenium_book_week_task(starting_week, sessions):
+    """Book every session of the week in one browser session and return a per-session report."""
+    groups, results = group_sessions_for_booking(starting_week, sessions)
+    if not groups:
+        return sorted(results, key=lambda r: r['index'])
+
+    with driver_pool.session("google", "pba") as driver:
+        wait = AdaptiveWait(driver)
+        for (court_location, court_type), dates in groups.items():
+            for booking_date in sorted(dates):
+                # The schema may reload after a booking; only re-open the court and date when it has gone
+                needs_navigation = True
+                for index, session in sorted(dates[booking_date], key=lambda item: item[1]['sessionStart']):
+                    try:
+                        if needs_navigation:
+                            select_court(wait, court_location, court_type)
+                            select_booking_date(driver, wait, booking_date)
+                            needs_navigation = False
+                        try:
+                            booked = book_timeslot(driver, wait, session['sessionStart'], session['sessionEnd'],
+                                                   await_reload=True)
+                        except SchemaReloadTimeout:
+                            # Booked, but the schema never reloaded; re-open the court and date for the next one
+                            booked, needs_navigation = True, True
+                        if booked:
+                            results.append(_booking_result(index, session, "booked", "Booking submitted."))
+                            availability_cache.invalidate(court_location, court_type, booking_date)
                         else:
-                            break
+                            results.append(_booking_result(index, session, "unavailable",
+                                                           "The session is not free on any lane."))
+                    except Exception as e:
+                        print(f"Error booking session {index}: {type(e).__name__}: {e}")
+                        results.append(_booking_result(index, session, "failed", f"{type(e).__name__}: {e}"))
+                        needs_navigation = True
 
-                    if current_time >= desired_end:
-                        for block in blocks_to_click:
-                            if not click_element_with_retry(driver, block):
-                                break
-                        booking_successful = True
-                        break
-                except StaleElementReferenceException:
-                    continue
-                except Exception:
-                    continue
+    return sorted(results, key=lambda r: r['index'])
 
-            if not booking_successful:
-                return
 
-            # Proceed with booking
-            try:
-                continue_button = wait.until(EC.element_to_be_clickable(
-                    (By.XPATH, "//a[contains(@class, 'showRecapDialog') and contains(@title, 'Continue')]")))
-                continue_button.click()
-            except Exception:
-                return
+def _send_instagram_message(driver, contact_info, message, send=False):
+    """Type the message into the student's Instagram chat.
 
-            try:
-                book_button = wait.until(EC.element_to_be_clickable(
-                    (By.XPATH, "//a[contains(@class, 'ui-state-default') and contains(text(), 'Book')]")))
-                book_button.click()
-            except Exception:
-                return
+    With send, Enter sends it straight away; otherwise the user gets MESSAGE_REVIEW_TIMEOUT seconds to review it
+    and send it themselves.
+    """
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.support import expected_conditions as EC
 
-        except Exception:
-            pass
+    try:
+        instagram_handle = contact_info.lstrip('@')
+        profile_url = f"{INSTAGRAM_BASE_URL}/{instagram_handle}/"
+        with tracer.step('navigation', url=profile_url):
+            driver.get(profile_url)
+        print(f"Navigated to Instagram handle: {instagram_handle}")
 
-        # Keep the browser open for manual inspection
+        wait = AdaptiveWait(driver)
         try:
-            while True:
-                time.sleep(5000)
-        except KeyboardInterrupt:
-            pass
+            message_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//div[text()='Message']")),
+                                        'instagram_message_button')
+            message_button.click()
+            print("Clicked on the 'Message' button.")
+        except TimeoutException:
+            print("Message button not found.")
+            raise
 
-    except Exception:
-        pass
-    finally:
-        driver.quit()
+        try:
+            not_now_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[text()='Not Now']")),
+                                        'instagram_not_now', timeout=WAIT_OPTIONAL_TIMEOUT)
+            not_now_button.click()
+            print("Clicked on 'Not Now' button.")
+        except TimeoutException:
+            print("'Not Now' button not found.")
 
+        try:
+            message_input = wait.until(
+                EC.presence_of_element_located(
+                    (By.XPATH, "//div[@aria-label='Message' and @contenteditable='true']")),
+                'instagram_message_input'
+            )
+            driver.execute_script("arguments[0].focus();", message_input)
+            message_input.send_keys(message)
+            print(f"Typed the message: {message}")
+        except Exception as e:
+            print(f"Failed to send message: {e}")
+            raise
 
-def selenium_message_student_task(contact_pref, contact_info, student_name, court_location, day_of_week, start_time,
-                                  end_time):
-    message = f"Hey {student_name}, are you down to train at {court_location}, on {day_of_week} from {datetime.strptime(start_time, '%H:%M').strftime('%I:%M %p')} to {datetime.strptime(end_time, '%H:%M').strftime('%I:%M %p')}?"
+        # The input clears once the message is sent
+        if send:
+            message_input.send_keys(Keys.ENTER)
+            try:
+                wait.until(lambda d: not message_input.text.strip(), 'instagram_message_sent')
+                return "Message sent."
+            except (TimeoutException, StaleElementReferenceException):
+                return "Message typed; Enter did not send it."
 
-    if contact_pref == "Instagram":
-        driver = get_chrome_driver()
+        # Give the user a bounded window to review and send
         try:
-            load_cookies(driver, "https://www.instagram.com/", "instagram_cookies.json")
-            instagram_handle = contact_info.lstrip('@')
-            driver.get(f"https://www.instagram.com/{instagram_handle}/")
-            print(f"Navigated to Instagram handle: {instagram_handle}")
+            WebDriverWait(driver, MESSAGE_REVIEW_TIMEOUT, poll_frequency=1).until(
+                lambda d: not message_input.text.strip())
+            return "Message sent."
+        except (TimeoutException, StaleElementReferenceException):
+            return "Message typed; not sent within the review window."
 
-            wait = WebDriverWait(driver, 30)
-            try:
-                message_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//div[text()='Message']")))
-                message_button.click()
-                print("Clicked on the 'Message' button.")
-            except TimeoutException:
-                print("Message button not found.")
-                return
+    except Exception as e:
+        print(f"An error occurred during Instagram messaging: {e}")
+        raise
 
-            try:
-                not_now_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[text()='Not Now']")))
-                not_now_button.click()
-                print("Clicked on 'Not Now' button.")
-            except TimeoutException:
-                print("'Not Now' button not found.")
 
-            try:
-                message_input = wait.until(
-                    EC.presence_of_element_located(
-                        (By.XPATH, "//div[@aria-label='Message' and @contenteditable='true']"))
-                )
-                driver.execute_script("arguments[0].focus();", message_input)
-                message_input.send_keys(message)
-                print(f"Typed the message: {message}")
-
-                time.sleep(500)
-            except Exception as e:
-                print(f"Failed to send message: {e}")
+def format_session_time(value):
+    return datetime.strptime(value, '%H:%M').strftime('%I:%M %p')
+
+
+def compose_student_message(student_name, sessions):
+    """One message covering all of a student's sessions, kept on a single line (Enter sends on Instagram)."""
+    parts = [f"at {session['courtLocation']}, on {session['dayOfWeek']} from "
+             f"{format_session_time(session['sessionStart'])} to {format_session_time(session['sessionEnd'])}"
+             for session in sessions]
+    return f"Hey {student_name}, are you down to train {', and '.join(parts)}?"
+
+
+def whatsapp_url(phone_number, message):
+    phone_number = phone_number.strip()
+    if not phone_number.startswith('+'):
+        raise ValueError("Invalid phone number format. Must start with '+'.")
+    return f"https://wa.me/{phone_number.replace('+', '')}?text={urllib.parse.quote(message)}"
 
-        except Exception as e:
-            print(f"An error occurred during Instagram messaging: {e}")
-        finally:
-            driver.quit()
-            print("Browser closed.")
 
+def selenium_message_student_task(contact_pref, contact_info, student_name, court_location, day_of_week, start_time,
+                                  end_time):
+    message = compose_student_message(student_name, [{
+        'courtLocation': court_location, 'dayOfWeek': day_of_week, 'sessionStart': start_time, 'sessionEnd': end_time,
+    }])
+
+    if contact_pref == "Instagram":
+        with driver_pool.session("instagram") as driver:
+            return _send_instagram_message(driver, contact_info, message)
     elif contact_pref == "WhatsApp":
+        phone_number = contact_info.strip()
+        url = whatsapp_url(phone_number, message)
         try:
-            phone_number = contact_info.strip()
-            if not phone_number.startswith('+'):
-                print("Invalid phone number format. Must start with '+'.")
-                return
-            phone_number_for_url = phone_number.replace('+', '')
-            message_encoded = urllib.parse.quote(message)
-            url = f"https://wa.me/{phone_number_for_url}?text={message_encoded}"
             webbrowser.open(url)
             print(f"Opened WhatsApp chat for {phone_number} with pre-filled message.")
             print("Please review the message and click 'Send' in WhatsApp Web to send the message.")
+            return "Opened WhatsApp chat with pre-filled message."
         except Exception as e:
             print(f"Error during WhatsApp messaging: {e}")
+            raise
     else:
         print(f"Unsupported contact preference: {contact_pref}")
+        raise ValueError(f"Unsupported contact preference: {contact_pref}")
+
+
+def group_sessions_for_messaging(sessions, students, include_messaged=False):
+    """Group the week's sessions per student; returns (groups, results for sessions that can't be messaged)."""
+    contacts = {student['name']: student for student in students}
+    groups, results = OrderedDict(), []
+    for session in sessions:
+        if session.get('statusMessaged') and not include_messaged:
+            continue
+        name = session.get('studentName')
+        missing = [field for field in BOOKING_FIELDS if not session.get(field) and field != 'courtType']
+        if not name or missing:
+            results.append({'studentName': name, 'sessionIds': [session.get('id')], 'channel': None,
+                            'status': 'skipped', 'detail': f"Incomplete session: {', '.join(missing) or 'studentName'}"})
+        elif name not in contacts:
+            results.append({'studentName': name, 'sessionIds': [session.get('id')], 'channel': None,
+                            'status': 'skipped', 'detail': 'Student data not found.'})
+        else:
+            groups.setdefault(name, []).append(session)
+    return [(contacts[name], group) for name, group in groups.items()], results
+
+
+def selenium_message_week_task(sessions, students, include_messaged=False):
+    """Send one message per student for the week: Instagram in one browser session, WhatsApp links in one batch.
+
+    Instagram messages are sent as they are typed; waiting for a manual send per student would hold the browser
+    for MESSAGE_REVIEW_TIMEOUT each, and a draft left unsent is lost once the browser moves on to the next student.
+    """
+    groups, results = group_sessions_for_messaging(sessions, students, include_messaged)
+    instagram, whatsapp = [], []
+    for student, group in groups:
+        result = {'studentName': student['name'], 'sessionIds': [session['id'] for session in group],
+                  'channel': student.get('contactPreference'), 'message': compose_student_message(student['name'], group)}
+        if result['channel'] == 'Instagram':
+            instagram.append((student, result))
+        elif result['channel'] == 'WhatsApp':
+            whatsapp.append((student, result))
+        else:
+            results.append(dict(result, status='failed', detail=f"Unsupported contact preference: {result['channel']}"))
+
+    for student, result in whatsapp:
+        try:
+            url = whatsapp_url(student['contactInfo'], result['message'])
+            webbrowser.open_new_tab(url)
+            results.append(dict(result, status='opened', detail='Opened WhatsApp chat with pre-filled message.'))
+        except Exception as e:
+            print(f"Error opening WhatsApp chat for {student['name']}: {e}")
+            results.append(dict(result, status='failed', detail=f"{type(e).__name__}: {e}"))
+
+    pending = list(instagram)
+    if pending:
+        try:
+            with driver_pool.session("instagram") as driver:
+                while pending:
+                    student, result = pending.pop(0)
+                    try:
+                        detail = _send_instagram_message(driver, student['contactInfo'], result['message'], send=True)
+                        status = 'sent' if detail == "Message sent." else 'typed'
+                        results.append(dict(result, status=status, detail=detail))
+                    except Exception as e:
+                        # Recorded on this student only; a dead browser then fails the next one the same way
+                        print(f"Error messaging {student['name']} on Instagram: {e}")
+                        results.append(dict(result, status='failed', detail=f"{type(e).__name__}: {e}"))
+        except Exception as e:
+            # The browser could not be started; everyone still waiting gets the same error
+            print(f"Error during Instagram messaging: {e}")
+            results.extend(dict(result, status='failed', detail=f"{type(e).__name__}: {e}") for _, result in pending)
+    return results
 
 
 # Flask Routes for Selenium Tasks
@@ -446,12 +3373,32 @@ def index():
 
 @app.route('/students')
 def get_students():
-    students = load_json('students.json')
+    students, etag = students_store.read()
     if students is not None:
-        return jsonify(students)
+        return conditional_json(students, etag)
     return jsonify({'error': 'Students data not found or invalid.'}), 404
 
 
+CREDIT_LINE_PATTERN = re.compile(r'(\d+)x \$([\d.]+)')
+TAG_PATTERN = re.compile(r'<[^>]*>')
+
+
+def parse_credits_to_buy(credits_to_buy):
+    """Expand "2x $13.00" lines (optionally separated by HTML tags) into one {'amount'} per credit.
+
+    Returns (credits_list, unparsed_lines).
+    """
+    credits_list, unparsed = [], []
+    for line in TAG_PATTERN.sub('\n', credits_to_buy).split('\n'):
+        match = CREDIT_LINE_PATTERN.match(line.strip())
+        if match:
+            times, amount = int(match.group(1)), float(match.group(2))
+            credits_list.extend([{'amount': amount} for _ in range(times)])
+        else:
+            unparsed.append(line.strip())
+    return credits_list, unparsed
+
+
 @app.route('/buy-credits', methods=['POST'])
 def buy_credits():
     data = request.get_json()
@@ -462,18 +3409,19 @@ def buy_credits():
     print("Received booking request:")
     print(f"Credits to Buy: {credits_to_buy}")
 
-    credits_list = []
-    for line in re.sub(r'<[^>]*>', '\n', credits_to_buy).split('\n'):
-        match = re.match(r'(\d+)x \$([\d.]+)', line.strip())
-        if match:
-            times, amount = int(match.group(1)), float(match.group(2))
-            credits_list.extend([{'amount': amount} for _ in range(times)])
-        else:
-            print(f"Could not parse line: {line.strip()}")
+    credits_list, unparsed = parse_credits_to_buy(credits_to_buy)
+    for line in unparsed:
+        print(f"Could not parse line: {line}")
+
+    target_balance = data.get('targetBalance')
+    if target_balance is not None:
+        try:
+            target_balance = float(target_balance)
+        except (TypeError, ValueError):
+            return "Invalid targetBalance.", 400
 
-    threading.Thread(target=selenium_buy_credits_task, args=(credits_list,)).start()
     print(f"Started buying process for {len(credits_list)} credits.")
-    return "Buying credits in progress!", 200
+    return submit_job('buy-credits', "Buying credits", selenium_buy_credits_task, credits_list, target_balance)
 
 
 @app.route('/book-court', methods=['POST'])
@@ -487,11 +3435,45 @@ def book_court():
     for field in required_fields:
         print(f"{field}: {data.get(field)}")
 
-    threading.Thread(target=selenium_book_court_task, args=(
+    return submit_job(
+        'book-court', "Booking court", run_with_outcome,
+        data.get('sessionId'), 'booking', selenium_book_court_task,
         data['startingWeek'], data['dayOfWeek'], data['courtLocation'],
         data['courtType'], data['sessionStart'], data['sessionEnd']
-    )).start()
-    return "Booking court in progress!", 200
+    )
+
+
+@app.route('/book-week', methods=['POST'])
+def book_week():
+    config = config_store.snapshot()
+    if not config or not config.get('weekStarting'):
+        return jsonify({'error': 'Config file not found or has no weekStarting.'}), 404
+
+    print(f"Received book week request for {config['weekStarting']}.")
+    return submit_job('book-week', f"Booking week of {config['weekStarting']}", book_week_task, config)
+
+
+def book_week_task(config):
+    results = selenium_book_week_task(config['weekStarting'], config.get('sessions', []))
+    for result in results:
+        config_store.record_outcome(config['sessions'][result['index']]['id'], 'booking', result['status'],
+                                    result['detail'])
+
+    # Record successful bookings back into the config, unless the sessions were edited meanwhile
+    booked = [config['sessions'][r['index']] for r in results if r['status'] == 'booked']
+    if booked:
+        def mark_booked(current):
+            if current.get('weekStarting') != config['weekStarting']:
+                return
+            for booked_session in booked:
+                session = find_session(current, booked_session['id'])
+                if session and all(session.get(field) == booked_session.get(field) for field in BOOKING_FIELDS):
+                    session['statusBooked'] = True
+                    touch_session(current, session)
+
+        config_store.update(mark_booked)
+
+    return {'weekStarting': config['weekStarting'], 'results': results}
 
 
 @app.route('/message-student', methods=['POST'])
@@ -506,12 +3488,63 @@ def message_student():
     for field in required_fields:
         print(f"{field}: {data.get(field)}")
 
-    threading.Thread(target=selenium_message_student_task, args=(
+    return submit_job(
+        'message-student', f"Messaging student via {data['contactPreference']}", run_with_outcome,
+        data.get('sessionId'), 'messaging', selenium_message_student_task,
         data['contactPreference'], data['contactInfo'], data['studentName'],
         data['courtLocation'], data['dayOfWeek'], data['startTime'], data['endTime']
-    )).start()
-    return f"Messaging student via {data['contactPreference']} in progress!", 200
+    )
+
+
+@app.route('/message-week', methods=['POST'])
+def message_week():
+    config = config_store.snapshot()
+    if not config or not config.get('weekStarting'):
+        return jsonify({'error': 'Config file not found or has no weekStarting.'}), 404
+    students = students_store.snapshot()
+    if students is None:
+        return jsonify({'error': 'Students data not found or invalid.'}), 404
+    include_messaged = bool((request.get_json(silent=True) or {}).get('includeMessaged'))
+
+    print(f"Received message week request for {config['weekStarting']}.")
+    return submit_job('message-week', f"Messaging students for week of {config['weekStarting']}", message_week_task,
+                      config, students, include_messaged)
+
+
+def message_week_task(config, students, include_messaged=False):
+    results = selenium_message_week_task(config.get('sessions', []), students, include_messaged)
+    for result in results:
+        for session_id in result['sessionIds']:
+            if session_id:
+                config_store.record_outcome(session_id, 'messaging', result['status'], result['detail'])
+
+    # Sessions count as messaged once the message went out or its WhatsApp chat was opened
+    messaged = {session_id for result in results if result['status'] in ('sent', 'opened')
+                for session_id in result['sessionIds']}
+    if messaged:
+        def mark_messaged(current):
+            if current.get('weekStarting') != config['weekStarting']:
+                return
+            for session_id in messaged:
+                session = find_session(current, session_id)
+                if session and not session.get('statusMessaged'):
+                    session['statusMessaged'] = True
+                    touch_session(current, session)
+
+        config_store.update(mark_messaged)
+
+    return {'weekStarting': config['weekStarting'], 'results': results}
+
+
+def prewarm_drivers():
+    if DRIVER_POOL_PREWARM:
+        threading.Thread(target=driver_pool.warm, args=(DRIVER_POOL_PREWARM, ("google", "pba")), daemon=True).start()
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Development server only; production runs under gunicorn: gunicorn -c gunicorn.conf.py app:app
+    debug = os.environ.get('FLASK_DEBUG') == '1'
+    # With the debug reloader only the child process should launch browsers
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        prewarm_drivers()
+    app.run(debug=debug)
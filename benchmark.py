@@ -0,0 +1,290 @@
+"""Offline benchmarks against saved page fixtures.
+
+    python benchmark.py                      # pure-Python parsing and slot planning
+    python benchmark.py --browser            # also compare WebDriver scans in headless Chrome
+    python benchmark.py --flows --runs 100   # also run booking, credit and Instagram flows end to end
+    python benchmark.py --startup            # time a cold `import app`, failing above STARTUP_TARGET
+    python benchmark.py --save-baseline bench.json
+    python benchmark.py --baseline bench.json --tolerance 1.5   # exit 1 when a benchmark got slower
+
+Flows run in headless Chrome against fixtures/ served from a local HTTP server, so no live site is hit.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+# Keep benchmark waits and step logs out of the real history database and step log
+_scratch = tempfile.mkdtemp(prefix='benchmark-')
+os.environ.setdefault('HISTORY_DB', os.path.join(_scratch, 'history.db'))
+os.environ.setdefault('STEP_LOG', os.path.join(_scratch, 'steps.jsonl'))
+
+import app  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+SCHEMA_FIXTURE = os.path.join(FIXTURES_DIR, 'pba_schema.html')
+CREDIT_LIST_FIXTURE = os.path.join(FIXTURES_DIR, 'pba_credit_list.html')
+STARTUP_TARGET = 0.5  # Seconds for a cold import of the app, which every WSGI worker pays before serving
+SESSIONS = [('09:00', '10:00'), ('15:00', '16:30'), ('17:00', '19:00'), ('19:00', '20:30'), ('20:00', '22:00')]
+CREDITS_TO_BUY = '<br>'.join(['2x $13.00', '1x $9.50', '3x $29.00', 'Total: $93.50', '1x $100.00'] * 10)
+# Request paths of the live sites mapped to the fixture standing in for them
+FIXTURE_ROUTES = {
+    '/user.php': 'pba_credit_list.html',
+    '/paypal': 'paypal.html',
+    '/booking': 'pba_booking.html',
+    '/instagram/': 'instagram_profile.html',
+}
+
+
+def load_schema_lanes(path=SCHEMA_FIXTURE):
+    with open(path, encoding='utf-8') as f:
+        return app.parse_schema_html(f.read())
+
+
+def legacy_plan(lanes, session_start, session_end):
+    # The per-row strptime scan book_timeslot used before the in-memory planner
+    desired_start = datetime.strptime(session_start, '%H:%M')
+    desired_end = datetime.strptime(session_end, '%H:%M')
+    for lane_index, lane in enumerate(lanes):
+        if not lane['displayed']:
+            continue
+        available_blocks = {}
+        for block_index, title in enumerate(lane['titles']):
+            if "Available" in title:
+                try:
+                    block_time = datetime.strptime(title.split('–')[0].strip(), '%I:%M%p')
+                    available_blocks[block_time] = block_index
+                except ValueError:
+                    continue
+        plan = []
+        current_time = desired_start
+        while current_time < desired_end and current_time in available_blocks:
+            plan.append((lane_index, available_blocks[current_time]))
+            current_time += timedelta(minutes=30)
+        if current_time >= desired_end:
+            return plan
+    return None
+
+
+def planner(lanes, session_start, session_end):
+    return app.plan_timeslot(app.parse_schema_grid(lanes), session_start, session_end)
+
+
+def time_runs(func, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def percentile(timings, fraction):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def report(results, name, timings, indent=''):
+    results[name] = {'mean': statistics.mean(timings), 'p95': percentile(timings, 0.95), 'runs': len(timings)}
+    print(f"{indent}{name:<{40 - len(indent)}} mean {results[name]['mean'] * 1000:9.3f} ms   "
+          f"p95 {results[name]['p95'] * 1000:9.3f} ms   ({len(timings)} runs)")
+
+
+def bench_parsing(results, runs):
+    with open(SCHEMA_FIXTURE, encoding='utf-8') as f:
+        schema_html = f.read()
+    with open(CREDIT_LIST_FIXTURE, encoding='utf-8') as f:
+        credit_html = f.read()
+    report(results, "/buy-credits line parsing", time_runs(lambda: app.parse_credits_to_buy(CREDITS_TO_BUY), runs))
+    report(results, "schema HTML parsing", time_runs(lambda: app.parse_schema_html(schema_html), runs))
+    report(results, "credit option parsing", time_runs(lambda: app.parse_credit_options(credit_html), runs))
+
+
+def bench_planning(results, runs):
+    lanes = load_schema_lanes()
+    for session_start, session_end in SESSIONS:
+        print(f"{session_start}-{session_end}: planner {planner(lanes, session_start, session_end)}")
+    report(results, "legacy per-row scan", time_runs(
+        lambda: [legacy_plan(lanes, *session) for session in SESSIONS], runs))
+    report(results, "parse grid + plan", time_runs(
+        lambda: [planner(lanes, *session) for session in SESSIONS], runs))
+
+
+def headless_chrome():
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
+    options = Options()
+    options.add_argument("--headless=new")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    return webdriver.Chrome(options=options)
+
+
+def bench_browser(results, runs):
+    from selenium.webdriver.common.by import By
+
+    driver = headless_chrome()
+    try:
+        driver.get(f"file://{SCHEMA_FIXTURE}")
+
+        def webdriver_scan():
+            schema_wrapper = driver.find_element(By.CLASS_NAME, 'schemaWrapper')
+            for row in schema_wrapper.find_elements(By.XPATH, ".//tr[starts-with(@class, 'trSchemaLane_')]"):
+                if not row.is_displayed():
+                    continue
+                for block in row.find_elements(By.XPATH, ".//td/div[@class='divHour']/a"):
+                    block.get_attribute('title')
+
+        def script_scan():
+            lanes = driver.execute_script(app.SCHEMA_GRID_SCRIPT)
+            plan = planner(lanes, *SESSIONS[0])
+            if plan:
+                driver.execute_script(app.SCHEMA_BLOCKS_SCRIPT, plan)
+
+        report(results, "WebDriver per-element scan", time_runs(webdriver_scan, runs))
+        report(results, "single execute_script scan", time_runs(script_scan, runs))
+    finally:
+        driver.quit()
+
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    """Serves fixtures/, answering the live sites' paths with the fixture that stands in for them."""
+
+    def translate_path(self, path):
+        for prefix, fixture in FIXTURE_ROUTES.items():
+            if path.startswith(prefix):
+                return os.path.join(FIXTURES_DIR, fixture)
+        return super().translate_path(path)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_fixtures():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(FixtureHandler, directory=FIXTURES_DIR))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def booking_flow(driver, url, booking_date, session_start, session_end):
+    # selenium_book_court_task against the fixture page, minus the pooled, cookie-authenticated browser
+    with app.tracer.step('navigation', url=url):
+        driver.get(url)
+    wait = app.AdaptiveWait(driver)
+    app.select_court(wait, "PBA Canningvale", "Hebat Court")
+    app.select_booking_date(driver, wait, booking_date)
+    if not app.book_timeslot(driver, wait, session_start, session_end):
+        raise RuntimeError(f"{session_start}-{session_end} is not free in the fixture schema.")
+
+
+def read_step_log(path):
+    """Durations per step and per wait from the tracer's JSON lines log."""
+    steps = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            name = f"step {record['step']}" if 'step' in record else f"wait {record['wait']}"
+            steps.setdefault(name, []).append(record['seconds'])
+    return steps
+
+
+def bench_flows(results, runs):
+    server, base_url = serve_fixtures()
+    app.PBA_BASE_URL = base_url
+    app.INSTAGRAM_BASE_URL = base_url + '/instagram'
+    # Two months ahead, so the stepping fallback has to page through the datepicker
+    today = datetime.now()
+    week = (today - timedelta(days=today.weekday()) + timedelta(weeks=9)).strftime('%Y-%m-%d')
+    booking_date = app.get_booking_date(week, 'Wednesday')
+    flows = {
+        "booking flow (setDate)": lambda driver: booking_flow(
+            driver, f"{base_url}/booking", booking_date, *SESSIONS[1]),
+        "booking flow (stepping)": lambda driver: booking_flow(
+            driver, f"{base_url}/booking?jquery=0", booking_date, *SESSIONS[1]),
+        "credit purchase flow": lambda driver: app.purchase_credit(driver, 13.0, None, time.monotonic() + 60),
+        "instagram message flow": lambda driver: app._send_instagram_message(
+            driver, '@student', app.compose_student_message('Student', [{
+                'courtLocation': "PBA Canningvale", 'dayOfWeek': 'Wednesday',
+                'sessionStart': '15:00', 'sessionEnd': '16:30'}])),
+    }
+
+    with app.tracer.step('driver_start'):
+        driver = headless_chrome()
+    try:
+        for name, flow in flows.items():
+            open(app.tracer.log_path, 'w').close()
+            report(results, name, time_runs(lambda: flow(driver), runs))
+            for step, timings in sorted(read_step_log(app.tracer.log_path).items()):
+                report(results, f"{name}: {step}", timings, indent='    ')
+    finally:
+        driver.quit()
+        server.shutdown()
+
+
+def bench_startup(results, runs):
+    """Time fresh interpreters importing the app, and serving a first /config; returns whether the target was met."""
+    def run(code):
+        subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+                       stdout=subprocess.DEVNULL)
+
+    report(results, "startup: import app", time_runs(lambda: run("import app"), runs))
+    report(results, "startup: first /config", time_runs(
+        lambda: run("import app; app.app.test_client().get('/config')"), runs))
+    met = results["startup: import app"]['mean'] <= STARTUP_TARGET
+    print(f"startup target {STARTUP_TARGET * 1000:.0f} ms: {'met' if met else 'MISSED'}")
+    return met
+
+
+def compare(results, baseline, tolerance):
+    """Print benchmarks whose mean grew beyond tolerance x baseline; returns how many regressed."""
+    regressions = 0
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous and result['mean'] > previous['mean'] * tolerance:
+            regressions += 1
+            print(f"REGRESSION {name}: mean {previous['mean'] * 1000:.3f} ms -> {result['mean'] * 1000:.3f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--browser', action='store_true', help="also run scans in headless Chrome")
+    parser.add_argument('--flows', action='store_true', help="also run end-to-end flows in headless Chrome")
+    parser.add_argument('--startup', action='store_true', help="also time a cold start against STARTUP_TARGET")
+    parser.add_argument('--save-baseline', metavar='FILE', help="write results as a baseline")
+    parser.add_argument('--baseline', metavar='FILE', help="compare results with a saved baseline")
+    parser.add_argument('--tolerance', type=float, default=1.5, help="allowed slowdown factor (default 1.5)")
+    args = parser.parse_args()
+
+    results = {}
+    bench_parsing(results, args.runs)
+    bench_planning(results, args.runs)
+    if args.browser:
+        bench_browser(results, max(1, args.runs // 20))
+    if args.flows:
+        bench_flows(results, max(1, args.runs // 20))
+    startup_met = bench_startup(results, max(3, args.runs // 20)) if args.startup else True
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            if compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
+    if not startup_met:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+"""Production server settings.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Runs two workers by default (WEB_CONCURRENCY). Each worker process has its own job threads and Chrome
+pool (up to DRIVER_POOL_SIZE browsers per worker). Sessions, job status, history and availability
+invalidations are shared through history.db, and lock files in LOCK_DIR keep browser profiles and
+single-flight jobs (credit purchases, week booking) from being used by two workers at once.
+
+/metrics stays per worker: each scrape sees the histograms of whichever worker answered, so scrape
+a single worker or aggregate per instance.
+"""
+import os
+import subprocess
+import sys
+
+bind = os.environ.get('BIND', '127.0.0.1:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+timeout = 60
+# Workers import the app themselves so none inherits the master's SQLite connections or threads
+preload_app = False
+
+
+def on_starting(server):
+    # Resolve chromedriver once, outside the workers, so they only read the cached path
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'resolve-chromedriver'], check=False)
+
+
+def post_worker_init(worker):
+    from app import prewarm_drivers
+    prewarm_drivers()
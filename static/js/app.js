@@ -211,8 +211,30 @@ const calculateCredits = (start, end, location, type, day) => {
     return credits.join('<br>');
 };
 
+// Poll a background job until it finishes
+const waitForJob = async (jobId, intervalMs = 2000) => {
+    while (true) {
+        const response = await fetch(`/jobs/${jobId}`);
+        const job = await response.json();
+        if (!response.ok) throw new Error(job.error);
+        if (job.state === 'succeeded' || job.state === 'failed') return job;
+        await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+};
+
+// Check every 30-minute step of a session is free on at least one lane
+const isSessionFree = (freeSlots, start, end) => {
+    const lanes = Object.values(freeSlots);
+    for (let t = convertTimeToMinutes(start); t < convertTimeToMinutes(end); t += 30) {
+        const slot = `${Math.floor(t / 60).toString().padStart(2, '0')}:${(t % 60).toString().padStart(2, '0')}`;
+        if (!lanes.some(lane => lane.includes(slot))) return false;
+    }
+    return true;
+};
+
 // Global Data
 let studentsData = [];
+let configVersion = null;
 
 // Populate Student Dropdown
 const populateStudentNameDropdown = select => {
@@ -228,6 +250,8 @@ const populateStudentNameDropdown = select => {
 const addNewRow = (session = {}) => {
     const tableBody = document.querySelector('#studentTable tbody');
     const newRow = document.createElement('tr');
+    newRow.dataset.sessionId = session.id || '';
+    newRow.dataset.version = session.version || '';
     newRow.innerHTML = `
         <td>
             <select name="studentName[]" class="student-name" data-type="Student" required></select>
@@ -266,7 +290,8 @@ const addNewRow = (session = {}) => {
         <td class="credits-to-buy"></td>
         <td class="status-column">
             <label><input type="checkbox" name="statusMessaged[]" ${session.statusMessaged ? 'checked' : ''}> Messaged</label><br>
-            <label><input type="checkbox" name="statusBooked[]" ${session.statusBooked ? 'checked' : ''}> Booked</label>
+            <label><input type="checkbox" name="statusBooked[]" ${session.statusBooked ? 'checked' : ''}> Booked</label><br>
+            <span class="availability"></span>
         </td>
         <td>
             <button type="button" class="message-button">Message</button>
@@ -420,9 +445,64 @@ const handleDayOfWeekChange = event => {
 // Handle Court Type Change
 const handleCourtTypeChange = () => updateCredits();
 
+// Session Patching
+
+// Read the session fields of a row
+const rowFields = row => ({
+    studentName: row.querySelector('.student-name').value,
+    dayOfWeek: row.querySelector('.day-of-week').value,
+    courtLocation: row.querySelector('.court-location').value,
+    sessionStart: row.querySelector('.session-start').value,
+    sessionEnd: row.querySelector('.session-end').value,
+    courtType: row.querySelector('.court-type').value,
+    statusMessaged: row.querySelector('input[name="statusMessaged[]"]').checked,
+    statusBooked: row.querySelector('input[name="statusBooked[]"]').checked
+});
+
+// Reload the table from the server
+const reloadConfig = async () => {
+    const response = await fetch('/config');
+    if (response.ok) loadConfig(await response.json());
+};
+
+// Send a request that changes one session and keep the row's version in sync
+const sendSessionChange = async (row, url, method, body) => {
+    try {
+        const response = await fetch(url, {
+            method,
+            headers: { 'Content-Type': 'application/json' },
+            body: body ? JSON.stringify(body) : undefined
+        });
+        const result = await response.json();
+        if (response.status === 409) {
+            alert('This session was changed elsewhere. Reloading the latest version.');
+            return reloadConfig();
+        }
+        if (!response.ok) return alert(`Failed to save change: ${result.error}`);
+        if (result.session) {
+            row.dataset.sessionId = result.session.id;
+            row.dataset.version = result.session.version;
+        }
+        configVersion = result.configVersion;
+    } catch {
+        alert('An error occurred while saving the change.');
+    }
+};
+
+const patchSession = (row, changes) => {
+    const id = row.dataset.sessionId;
+    if (!id) return;
+    return sendSessionChange(row, `/sessions/${id}`, 'PATCH', { ...changes, version: Number(row.dataset.version) });
+};
+
+const createSession = row => sendSessionChange(row, '/sessions', 'POST', rowFields(row));
+
 // Delete a Row
 const deleteRow = event => {
-    event.target.closest('tr').remove();
+    const row = event.target.closest('tr');
+    const id = row.dataset.sessionId;
+    if (id) sendSessionChange(row, `/sessions/${id}?version=${row.dataset.version}`, 'DELETE');
+    row.remove();
     updateCredits();
 };
 
@@ -474,6 +554,7 @@ const handleMessage = row => {
     }
 
     const data = {
+        sessionId: row.dataset.sessionId || undefined,
         contactPreference: student.contactPreference,
         contactInfo: student.contactInfo,
         studentName,
@@ -488,8 +569,8 @@ const handleMessage = row => {
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(data),
     })
-    .then(response => response.text())
-    .then(result => alert(result))
+    .then(response => response.json())
+    .then(result => alert(result.error || `${result.message} (job ${result.jobId})`))
     .catch(() => alert('An error occurred while messaging the student.'));
 };
 
@@ -503,8 +584,8 @@ const handleBuyCredits = row => {
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ creditsToBuy: credits }),
     })
-    .then(response => response.text())
-    .then(result => alert(result))
+    .then(response => response.json())
+    .then(result => alert(result.error || `${result.message} (job ${result.jobId})`))
     .catch(() => alert('An error occurred while buying credits.'));
 };
 
@@ -512,6 +593,7 @@ const handleBuyCredits = row => {
 const handleBookCourt = row => {
     const startingWeek = document.getElementById('weekStarting').value;
     const data = {
+        sessionId: row.dataset.sessionId || undefined,
         startingWeek,
         dayOfWeek: row.querySelector('.day-of-week').value,
         courtLocation: row.querySelector('.court-location').value,
@@ -525,8 +607,8 @@ const handleBookCourt = row => {
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(data),
     })
-    .then(response => response.text())
-    .then(result => alert(result))
+    .then(response => response.json())
+    .then(result => alert(result.error || `${result.message} (job ${result.jobId})`))
     .catch(() => alert('An error occurred while booking court.'));
 };
 
@@ -534,6 +616,7 @@ const handleBookCourt = row => {
 const handleAddToCalendar = row => {
     const startingWeek = document.getElementById('weekStarting').value;
     const data = {
+        sessionId: row.dataset.sessionId || undefined,
         startingWeek,
         studentName: row.querySelector('.student-name').value,
         dayOfWeek: row.querySelector('.day-of-week').value,
@@ -547,8 +630,8 @@ const handleAddToCalendar = row => {
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(data),
     })
-    .then(response => response.text())
-    .then(result => alert(result))
+    .then(response => response.json())
+    .then(result => alert(result.error || `${result.message} (job ${result.jobId})`))
     .catch(() => alert('An error occurred while adding to calendar.'));
 };
 
@@ -559,32 +642,38 @@ const initializeEventListeners = () => {
     // Change Events
     tableBody.addEventListener('change', event => {
         const target = event.target;
+        const row = target.closest('tr');
         if (target.classList.contains('court-location')) handleCourtLocationChange(event);
         if (target.classList.contains('day-of-week')) handleDayOfWeekChange(event);
         if (target.classList.contains('session-start')) handleSessionStartChange(event);
         if (target.classList.contains('session-end')) updateCredits();
         if (target.classList.contains('court-type')) handleCourtTypeChange(event);
+
+        // Status toggles send just the flag; other edits send the row's fields
+        if (target.name === 'statusMessaged[]' || target.name === 'statusBooked[]') {
+            patchSession(row, { [target.name.replace('[]', '')]: target.checked });
+        } else if (target.tagName === 'SELECT') {
+            patchSession(row, rowFields(row));
+        }
     });
 
     // Click Events
     tableBody.addEventListener('click', handleButtonClick);
 
     // Add Row Button
-    document.getElementById('addRow').addEventListener('click', () => addNewRow());
+    document.getElementById('addRow').addEventListener('click', () => {
+        addNewRow();
+        createSession(document.querySelector('#studentTable tbody tr:last-child'));
+    });
 
     // Save Config Button
     document.getElementById('saveConfigButton').addEventListener('click', async () => {
         const configData = {
+            version: configVersion,
             weekStarting: document.getElementById('weekStarting').value,
             sessions: Array.from(document.querySelectorAll('#studentTable tbody tr')).map(row => ({
-                studentName: row.querySelector('.student-name').value,
-                dayOfWeek: row.querySelector('.day-of-week').value,
-                courtLocation: row.querySelector('.court-location').value,
-                sessionStart: row.querySelector('.session-start').value,
-                sessionEnd: row.querySelector('.session-end').value,
-                courtType: row.querySelector('.court-type').value,
-                statusMessaged: row.querySelector('input[name="statusMessaged[]"]').checked,
-                statusBooked: row.querySelector('input[name="statusBooked[]"]').checked
+                id: row.dataset.sessionId || undefined,
+                ...rowFields(row)
             }))
         };
 
@@ -595,24 +684,165 @@ const initializeEventListeners = () => {
                 body: JSON.stringify(configData)
             });
             const result = await response.json();
+            if (response.ok) configVersion = result.version;
             alert(response.ok ? result.message : `Failed to save: ${result.error}`);
+            if (response.status === 409) await reloadConfig();
         } catch {
             alert('An error occurred while saving configuration.');
         }
     });
 
+    // Book Whole Week Button
+    document.getElementById('bookWeekButton').addEventListener('click', async () => {
+        try {
+            const response = await fetch('/book-week', { method: 'POST' });
+            const submitted = await response.json();
+            if (!response.ok) return alert(`Failed to book week: ${submitted.error}`);
+            const job = await waitForJob(submitted.jobId);
+            if (job.state === 'failed') return alert(`Failed to book week: ${job.error}`);
+            const result = job.result;
+            alert(result.results.map(r =>
+                `${r.studentName} ${r.dayOfWeek} ${r.sessionStart}-${r.sessionEnd}: ${r.status} (${r.detail})`
+            ).join('\n') || 'No sessions to book.');
+            await reloadConfig();
+        } catch {
+            alert('An error occurred while booking the week.');
+        }
+    });
+
+    // Message Whole Week Button
+    document.getElementById('messageWeekButton').addEventListener('click', async () => {
+        try {
+            const response = await fetch('/message-week', { method: 'POST' });
+            const submitted = await response.json();
+            if (!response.ok) return alert(`Failed to message students: ${submitted.error}`);
+            const job = await waitForJob(submitted.jobId);
+            if (job.state === 'failed') return alert(`Failed to message students: ${job.error}`);
+            alert(job.result.results.map(r =>
+                `${r.studentName} (${r.sessionIds.length} session(s)): ${r.status} (${r.detail})`
+            ).join('\n') || 'No students to message.');
+            await reloadConfig();
+        } catch {
+            alert('An error occurred while messaging students.');
+        }
+    });
+
+    // Sync Week to Calendar Button
+    document.getElementById('syncCalendarButton').addEventListener('click', async () => {
+        try {
+            const response = await fetch('/sync-calendar', { method: 'POST' });
+            const submitted = await response.json();
+            if (!response.ok) return alert(`Failed to sync calendar: ${submitted.error}`);
+            const job = await waitForJob(submitted.jobId);
+            if (job.state === 'failed') return alert(`Failed to sync calendar: ${job.error}`);
+            alert(job.result.map(r =>
+                `${r.studentName} ${r.dayOfWeek} ${r.sessionStart}: ${r.status}`
+            ).join('\n') || 'No sessions to sync.');
+        } catch {
+            alert('An error occurred while syncing the calendar.');
+        }
+    });
+
+    // Check Availability Button
+    document.getElementById('checkAvailabilityButton').addEventListener('click', async () => {
+        const week = document.getElementById('weekStarting').value;
+        if (!week) return alert('Please select a week first.');
+        const rows = Array.from(document.querySelectorAll('#studentTable tbody tr'));
+        const locations = [...new Set(rows.map(row => row.querySelector('.court-location').value)
+            .filter(location => location && location !== 'Kingsway'))];
+
+        try {
+            const results = await Promise.all(locations.map(location =>
+                fetch(`/availability?week=${week}&location=${encodeURIComponent(location)}`).then(res => res.json())));
+            const failed = results.filter(result => result.error).map(result => result.error);
+            if (failed.length) alert(`Could not check availability: ${failed.join('\n')}`);
+            const entries = results.flatMap(result => result.availability || []);
+            rows.forEach(row => {
+                const cell = row.querySelector('.availability');
+                const match = entries.find(entry =>
+                    entry.courtLocation === row.querySelector('.court-location').value &&
+                    (entry.courtType === null || entry.courtType === row.querySelector('.court-type').value) &&
+                    entry.dayOfWeek === row.querySelector('.day-of-week').value);
+                const start = row.querySelector('.session-start').value;
+                const end = row.querySelector('.session-end').value;
+                cell.title = '';
+                if (match && match.error) {
+                    // The schema fetch failed, so the court may or may not be free
+                    cell.textContent = 'Availability unknown';
+                    cell.title = match.error;
+                } else if (!match || !start || !end) {
+                    cell.textContent = '';
+                } else {
+                    cell.textContent = isSessionFree(match.freeSlots, start, end) ? 'Court free' : 'Court not free';
+                }
+            });
+        } catch {
+            alert('An error occurred while checking availability.');
+        }
+    });
+
+    // Save Week as Templates Button
+    document.getElementById('saveTemplatesButton').addEventListener('click', async () => {
+        try {
+            const response = await fetch('/templates/from-week', { method: 'POST' });
+            const result = await response.json();
+            if (!response.ok) return alert(`Failed to save templates: ${result.error}`);
+            alert(`Saved ${result.created.length} template(s)` +
+                (result.skipped.length ? `, skipped ${result.skipped.length}.` : '.'));
+        } catch {
+            alert('An error occurred while saving templates.');
+        }
+    });
+
+    // Generate Week from Templates Button
+    document.getElementById('generateWeekButton').addEventListener('click', async () => {
+        const week = document.getElementById('weekStarting').value;
+        if (!week) return alert('Please select a week first.');
+        const replace = document.querySelectorAll('#studentTable tbody tr').length > 0 &&
+            confirm('Replace this week\'s existing sessions with the templates?');
+        try {
+            const response = await fetch('/weeks/generate', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ weekStarting: week, replace, makeCurrent: true })
+            });
+            const result = await response.json();
+            if (!response.ok) return alert(`Failed to generate week: ${result.error}`);
+            await reloadConfig();
+            alert(result[0].generated
+                ? `Generated ${result[0].sessions} session(s) from templates.`
+                : 'Week already has sessions; kept them.');
+        } catch {
+            alert('An error occurred while generating the week.');
+        }
+    });
+
     // Week Starting date validation
     const weekStartingInput = document.getElementById('weekStarting');
     weekStartingInput.addEventListener('change', function () {
         if (this.value && !validateMonday(this.value)) {
             alert('Please select a Monday for "Week Starting".');
             this.value = '';
+            return;
         }
+        fetch('/config', {
+            method: 'PATCH',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ weekStarting: this.value, version: configVersion })
+        })
+        .then(async response => {
+            const result = await response.json();
+            if (!response.ok) alert(`Failed to switch week: ${result.error}`);
+            // The week's stored sessions (or a fresh copy of the last week's) replace the table
+            await reloadConfig();
+        })
+        .catch(() => alert('An error occurred while saving the week.'));
     });
 };
 
 // Load Configuration Data
 const loadConfig = data => {
+    configVersion = data.version ?? null;
     document.getElementById('weekStarting').value = data.weekStarting || '';
     document.querySelector('#studentTable tbody').innerHTML = '';
     data.sessions.forEach(session => addNewRow(session));
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# Keep test runs out of the real history database, step log and lock files, as benchmark.py does
+_scratch = tempfile.mkdtemp(prefix='tests-')
+os.environ.setdefault('HISTORY_DB', os.path.join(_scratch, 'history.db'))
+os.environ.setdefault('STEP_LOG', os.path.join(_scratch, 'steps.jsonl'))
+os.environ.setdefault('LOCK_DIR', os.path.join(_scratch, 'locks'))
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
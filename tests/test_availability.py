@@ -0,0 +1,70 @@
+from datetime import date
+
+import pytest
+
+import app
+
+BOOKING_DATE = date(2024, 12, 25)
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    fetched = []
+
+    class Client:
+        def fetch_availability(self, court_location, court_type, booking_date):
+            fetched.append((court_location, court_type, booking_date))
+            return [[len(fetched)]]
+
+    monkeypatch.setattr(app, 'get_pba_client', lambda: Client())
+    return fetched
+
+
+@pytest.fixture
+def workers(tmp_path):
+    # Two caches over one history.db behave like the caches of two gunicorn workers
+    store = app.HistoryStore(str(tmp_path / 'history.db'))
+    return app.AvailabilityCache(store=store), app.AvailabilityCache(store=store)
+
+
+def test_a_booking_in_one_worker_invalidates_the_others(fetches, workers):
+    booking, other = workers
+    other.get("PBA Malaga", None, BOOKING_DATE)
+    assert other.get("PBA Malaga", None, BOOKING_DATE) == ([[1]], True)
+
+    booking.invalidate("PBA Malaga", None, BOOKING_DATE)
+
+    assert other.get("PBA Malaga", None, BOOKING_DATE) == ([[2]], False)
+    assert other.get("PBA Malaga", None, BOOKING_DATE) == ([[2]], True)
+
+
+def test_invalidation_is_per_court_and_date(fetches, workers):
+    booking, other = workers
+    other.get("PBA Malaga", None, BOOKING_DATE)
+    other.get("PBA Canningvale", "Hebat Court", BOOKING_DATE)
+
+    booking.invalidate("PBA Canningvale", "Hebat Court", BOOKING_DATE)
+
+    assert other.get("PBA Malaga", None, BOOKING_DATE)[1] is True
+    assert other.get("PBA Canningvale", "Hebat Court", BOOKING_DATE)[1] is False
+
+
+def test_invalidating_everything_reaches_every_worker(fetches, workers):
+    booking, other = workers
+    other.get("PBA Malaga", None, BOOKING_DATE)
+    other.get("PBA Canningvale", "Hebat Court", BOOKING_DATE)
+
+    booking.invalidate()
+
+    assert other.get("PBA Malaga", None, BOOKING_DATE)[1] is False
+    assert other.get("PBA Canningvale", "Hebat Court", BOOKING_DATE)[1] is False
+
+
+def test_stamps_older_than_the_ttl_are_pruned(tmp_path):
+    store = app.HistoryStore(str(tmp_path / 'history.db'))
+    store.invalidate_availability("PBA Malaga", None, '2024-12-25')
+
+    store.invalidate_availability(prune_before=store.availability_invalidated_at("PBA Malaga", None, '2024-12-25') + 1)
+
+    rows = store._connection().execute("SELECT court_location FROM availability_invalidations").fetchall()
+    assert [row['court_location'] for row in rows] == ['*']
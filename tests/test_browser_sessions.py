@@ -0,0 +1,71 @@
+import json
+import time
+
+import pytest
+
+import app
+
+
+class FakeDriver:
+    def __init__(self, cookies=()):
+        self.cookies = list(cookies)
+        self.loaded = []
+        self.window_handles = ['main']
+        self.switch_to = self
+
+    def execute_cdp_cmd(self, command, params):
+        if command == 'Network.getAllCookies':
+            return {'cookies': self.cookies}
+        self.loaded.extend(params['cookies'])
+        return {}
+
+    def window(self, handle):
+        pass
+
+    def get(self, url):
+        pass
+
+    def quit(self):
+        pass
+
+
+def cookie_file(tmp_path, monkeypatch, expires):
+    path = tmp_path / 'pba_cookies.json'
+    path.write_text(json.dumps([{'domain': '.pba.yepbooking.com.au', 'name': 'PHPSESSID', 'value': 'abc', 'path': '/',
+                                 'expirationDate': expires}]))
+    monkeypatch.setitem(app.COOKIE_SITES, 'pba', ("https://pba.yepbooking.com.au", str(path)))
+
+
+def test_live_saved_cookies_are_replayed(tmp_path, monkeypatch):
+    cookie_file(tmp_path, monkeypatch, time.time() + 3600)
+    driver, state = FakeDriver(), app.SessionStateManager(profile_dir='')
+
+    assert state.ensure_login(driver, 'pba') == 'replayed'
+    assert [cookie['name'] for cookie in driver.loaded] == ['PHPSESSID']
+
+
+def test_expired_logins_raise_instead_of_replaying(tmp_path, monkeypatch):
+    cookie_file(tmp_path, monkeypatch, time.time() - 60)
+    driver, state = FakeDriver(), app.SessionStateManager(profile_dir='')
+
+    with pytest.raises(app.LoginExpired, match='pba'):
+        state.ensure_login(driver, 'pba')
+
+    assert driver.loaded == []
+    assert state.status()[0]['state'] == 'expired'
+
+
+def test_an_expired_login_returns_the_browser_to_the_pool(monkeypatch):
+    def ensure_login(driver, site):
+        raise app.LoginExpired(site)
+
+    monkeypatch.setattr(app, 'get_chrome_driver', lambda profile=None: FakeDriver())
+    monkeypatch.setattr(app.session_state, 'ensure_login', ensure_login)
+    monkeypatch.setattr(app.session_state, 'slots', 0)
+    pool = app.DriverPool(size=1)
+
+    with pytest.raises(app.LoginExpired):
+        pool.acquire(('pba',))
+
+    assert len(pool._idle) == 1
+    assert pool._slots.acquire(blocking=False)
@@ -0,0 +1,88 @@
+import json
+
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpMockSequence
+
+import app
+
+WEEK = '2024-12-23'
+SESSIONS = [
+    {'studentName': 'Alice', 'dayOfWeek': 'Monday', 'courtLocation': 'PBA Malaga',
+     'sessionStart': '17:00', 'sessionEnd': '18:00'},
+    {'studentName': 'Bob', 'dayOfWeek': 'Tuesday', 'courtLocation': 'PBA Canningvale',
+     'sessionStart': '18:00', 'sessionEnd': '19:30'},
+    {'studentName': 'Carol', 'dayOfWeek': 'Wednesday', 'courtLocation': 'PBA Malaga',
+     'sessionStart': '19:00', 'sessionEnd': '20:00'},
+]
+BOUNDARY = 'batch_boundary'
+REASONS = {200: 'OK', 409: 'Conflict', 500: 'Internal Server Error'}
+
+
+def batch_response(*parts):
+    """A multipart/mixed batch reply from (request_id, status, body) parts."""
+    content = ''
+    for request_id, status, body in parts:
+        content += (f'--{BOUNDARY}\r\nContent-Type: application/http\r\n'
+                    f'Content-ID: <response-test + {request_id}>\r\n\r\n'
+                    f'HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n\r\n'
+                    f'{json.dumps(body)}\r\n')
+    content += f'--{BOUNDARY}--'
+    return {'status': '200', 'content-type': f'multipart/mixed; boundary={BOUNDARY}'}, content
+
+
+def event(index, sessions=SESSIONS):
+    session = sessions[index]
+    event_id = app.calendar_event_id(WEEK, session['studentName'], session['dayOfWeek'], session['sessionStart'])
+    return {'id': event_id, 'htmlLink': f'https://calendar.test/{event_id}'}
+
+
+def calendar_service(*responses):
+    http = HttpMockSequence(list(responses))
+    return build('calendar', 'v3', http=http, static_discovery=True, cache_discovery=False), http
+
+
+def test_inserts_every_session_in_one_batch():
+    service, http = calendar_service(batch_response(*[(i, 200, event(i)) for i in range(len(SESSIONS))]))
+
+    results = app.sync_week_to_calendar(WEEK, SESSIONS, service=service)
+
+    assert [r['status'] for r in results] == ['created'] * 3
+    assert [r['eventId'] for r in results] == [event(i)['id'] for i in range(3)]
+    assert results[0]['detail'] == event(0)['htmlLink']
+    assert len(http.request_sequence) == 1
+    uri, method, body, _ = http.request_sequence[0]
+    assert method == 'POST' and uri.endswith('/batch/calendar/v3')
+    assert body.count('POST /calendar/v3/calendars/primary/events') == 3
+
+
+def test_conflicts_are_updated_in_a_second_batch():
+    conflict = {'error': {'code': 409, 'message': 'The requested identifier already exists.'}}
+    service, http = calendar_service(
+        batch_response((0, 200, event(0)), (1, 409, conflict), (2, 409, conflict)),
+        batch_response((1, 200, event(1)), (2, 500, {'error': {'code': 500, 'message': 'Backend Error'}})))
+
+    results = app.sync_week_to_calendar(WEEK, SESSIONS, service=service)
+
+    assert [r['status'] for r in results] == ['created', 'updated', 'failed']
+    assert results[2]['eventId'] == event(2)['id']
+    assert len(http.request_sequence) == 2
+    updates = http.request_sequence[1][2]
+    assert 'POST /calendar/v3/calendars/primary/events' not in updates
+    for index in (1, 2):
+        assert f"PUT /calendar/v3/calendars/primary/events/{event(index)['id']}" in updates
+
+
+def test_invalid_sessions_are_reported_without_a_request():
+    sessions = [SESSIONS[0], dict(SESSIONS[1], dayOfWeek='Someday'), {'studentName': 'Dave'},
+                dict(SESSIONS[2], sessionStart='7pm')]
+    service, http = calendar_service(batch_response((0, 200, event(0, sessions))))
+
+    results = app.sync_week_to_calendar(WEEK, sessions, service=service)
+
+    assert [r['status'] for r in results] == ['created', 'failed', 'failed', 'failed']
+    for result in results[1:]:
+        assert result['detail'].startswith('Invalid session:')
+        assert result['eventId'] is None
+    assert results[2]['studentName'] == 'Dave'
+    assert len(http.request_sequence) == 1
+    assert http.request_sequence[0][2].count('POST /calendar/v3/calendars/primary/events') == 1
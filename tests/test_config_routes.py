@@ -0,0 +1,46 @@
+import pytest
+
+import app
+
+WEEK = '2024-12-23'
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    store = app.HistoryStore(str(tmp_path / 'history.db'))
+    store.write({'weekStarting': WEEK, 'sessions': [
+        {'studentName': 'Alice', 'dayOfWeek': 'Monday', 'courtLocation': 'PBA Malaga',
+         'sessionStart': '17:00', 'sessionEnd': '18:00'}]})
+    monkeypatch.setattr(app, 'config_store', store)
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize('week', ['2025-01-07', '2025-1-6', 'next week', None])
+def test_switching_to_anything_but_a_monday_is_rejected(client, week):
+    response = client.patch('/config', json={'weekStarting': week})
+
+    assert response.status_code == 400
+    assert app.config_store.read()[0]['weekStarting'] == WEEK
+    assert app.config_store.query_sessions(start='2025-01-01') == []
+
+
+def test_saving_a_non_monday_week_is_rejected(client):
+    response = client.post('/save-config', json={'weekStarting': '2025-01-08', 'sessions': []})
+
+    assert response.status_code == 400
+    assert 'Monday' in response.get_json()['error']
+    assert len(app.config_store.read()[0]['sessions']) == 1
+
+
+def test_switching_to_a_monday_is_accepted(client):
+    response = client.patch('/config', json={'weekStarting': '2025-01-06'})
+
+    assert response.status_code == 200
+    assert app.config_store.read()[0]['weekStarting'] == '2025-01-06'
+
+
+def test_the_store_refuses_non_monday_weeks(client):
+    with pytest.raises(ValueError):
+        app.config_store.switch_week('2025-01-07')
+    with pytest.raises(ValueError):
+        app.config_store.materialize_week('2025-01-07')
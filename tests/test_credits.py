@@ -0,0 +1,62 @@
+from contextlib import contextmanager
+
+import pytest
+
+import app
+
+OPTIONS = {13.0: '103', 29.0: '108', 100.0: '109'}
+
+
+@pytest.fixture
+def purchases(monkeypatch):
+    bought = []
+
+    @contextmanager
+    def session(*sites, timeout=None):
+        yield None
+
+    monkeypatch.setattr(app.driver_pool, 'session', session)
+    monkeypatch.setattr(app, 'purchase_credit', lambda driver, amount, value, deadline: bought.append(amount))
+    monkeypatch.setattr(app, 'CREDIT_PURCHASE_PARALLELISM', 1)
+    return bought
+
+
+def account(monkeypatch, balance):
+    monkeypatch.setattr(app, 'read_credit_account', lambda: (OPTIONS, balance))
+
+
+def test_existing_balance_counts_towards_the_requested_total(monkeypatch, purchases):
+    account(monkeypatch, 200.0)
+
+    ledger = app.selenium_buy_credits_task([{'amount': 100.0}] * 5)
+
+    assert purchases == [100.0, 100.0, 100.0]
+    assert [entry['status'] for entry in ledger['ledger']] == ['purchased'] * 3 + ['skipped'] * 2
+    assert ledger['startingBalance'] == 200.0
+    assert ledger['targetBalance'] == 500.0
+
+
+def test_purchases_stop_once_the_target_balance_is_reached(monkeypatch, purchases):
+    account(monkeypatch, 10.0)
+
+    ledger = app.selenium_buy_credits_task([{'amount': 13.0}, {'amount': 13.0}, {'amount': 29.0}], 30.0)
+
+    assert purchases == [13.0, 13.0]
+    assert ledger['targetTotal'] == 20.0
+
+
+def test_nothing_is_bought_when_the_balance_already_covers_it(monkeypatch, purchases):
+    account(monkeypatch, 50.0)
+
+    ledger = app.selenium_buy_credits_task([{'amount': 29.0}])
+
+    assert purchases == []
+    assert ledger['ledger'][0]['status'] == 'skipped'
+
+
+def test_unknown_balance_buys_everything_requested(monkeypatch, purchases):
+    account(monkeypatch, None)
+
+    app.selenium_buy_credits_task([{'amount': 13.0}, {'amount': 29.0}])
+
+    assert purchases == [13.0, 29.0]
@@ -0,0 +1,35 @@
+import app
+
+
+def stored_job(store, worker, state='running'):
+    job = app.Job('book-week', 'Booking', worker)
+    job.state = state
+    store.save_job(job.to_dict())
+    return job.id
+
+
+def test_jobs_of_stopped_workers_are_failed_on_start(tmp_path):
+    store = app.HistoryStore(str(tmp_path / 'history.db'))
+    live = app.JobScheduler(store=store)
+    running = stored_job(store, live.worker_id)
+    orphaned = stored_job(store, 'gone-1')
+    queued = stored_job(store, 'gone-2', state='queued')
+    legacy = stored_job(store, None)
+    finished = stored_job(store, 'gone-3', state='succeeded')
+
+    assert app.JobScheduler(store=store).reconcile() == 0
+
+    states = {job_id: store.get_job(job_id)['state'] for job_id in (running, orphaned, queued, legacy, finished)}
+    assert states == {running: 'running', orphaned: 'failed', queued: 'failed', legacy: 'failed',
+                      finished: 'succeeded'}
+    assert store.get_job(orphaned)['error'].startswith('Interrupted')
+    assert store.get_job(orphaned)['finishedAt']
+
+
+def test_list_jobs_filters_on_several_states(tmp_path):
+    store = app.HistoryStore(str(tmp_path / 'history.db'))
+    for state in ('queued', 'running', 'failed'):
+        stored_job(store, 'gone-1', state=state)
+
+    assert sorted(job['state'] for job in store.list_jobs(state=('queued', 'running'))) == ['queued', 'running']
+    assert [job['state'] for job in store.list_jobs(state='failed')] == ['failed']
@@ -0,0 +1,68 @@
+from contextlib import contextmanager
+
+from selenium.webdriver.common.keys import Keys
+
+import app
+
+
+class FakeElement:
+    def __init__(self):
+        self.text = ''
+
+    def is_displayed(self):
+        return True
+
+    def is_enabled(self):
+        return True
+
+    def click(self):
+        pass
+
+    def send_keys(self, keys):
+        self.text = '' if keys == Keys.ENTER else self.text + keys
+
+
+class FakeDriver:
+    def __init__(self):
+        self.input = FakeElement()
+        self.visited = []
+
+    def get(self, url):
+        self.visited.append(url)
+
+    def find_element(self, by, value):
+        return self.input
+
+    def execute_script(self, script, *args):
+        pass
+
+
+def test_instagram_messages_are_sent_with_enter():
+    driver = FakeDriver()
+
+    assert app._send_instagram_message(driver, '@alice', 'Hey Alice', send=True) == "Message sent."
+    assert driver.visited == [f"{app.INSTAGRAM_BASE_URL}/alice/"]
+
+
+def test_message_week_sends_every_instagram_student_in_one_browser(monkeypatch):
+    driver, sent, send_message = FakeDriver(), [], app._send_instagram_message
+
+    @contextmanager
+    def session(site):
+        yield driver
+
+    def send(driver, contact_info, message, send=False):
+        sent.append((contact_info, send))
+        return send_message(driver, contact_info, message, send)
+
+    monkeypatch.setattr(app.driver_pool, 'session', session)
+    monkeypatch.setattr(app, '_send_instagram_message', send)
+    students = [{'name': name, 'contactPreference': 'Instagram', 'contactInfo': f'@{name.lower()}'}
+                for name in ('Alice', 'Bob')]
+    sessions = [{'id': str(index), 'studentName': student['name'], 'dayOfWeek': 'Monday', 'courtLocation': 'PBA Malaga',
+                 'sessionStart': '17:00', 'sessionEnd': '18:00'} for index, student in enumerate(students)]
+
+    results = app.selenium_message_week_task(sessions, students)
+
+    assert sent == [('@alice', True), ('@bob', True)]
+    assert [result['status'] for result in results] == ['sent', 'sent']
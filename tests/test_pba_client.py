@@ -0,0 +1,78 @@
+from datetime import date
+
+import pytest
+
+import app
+import benchmark
+
+BOOKING_DATE = date(2024, 12, 25)
+SCHEMA_PATHS = {("PBA Canningvale", "Hebat Court"): "/pba_schema.html?day={date}"}
+
+
+@pytest.fixture(scope='module')
+def base_url():
+    server, url = benchmark.serve_fixtures()
+    yield url
+    server.shutdown()
+
+
+def client(base_url, schema_paths=SCHEMA_PATHS):
+    return app.PbaClient(base_url=base_url, cookie_file='missing_cookies.json', timeout=5, schema_paths=schema_paths)
+
+
+def test_fetch_availability_reads_the_schema_fixture(base_url):
+    grid = client(base_url).fetch_availability("PBA Canningvale", "Hebat Court", BOOKING_DATE)
+
+    assert grid == app.parse_schema_grid(benchmark.load_schema_lanes())
+    assert any(grid)
+
+
+def test_fetch_availability_falls_back_to_the_location_path(base_url):
+    paths = {("PBA Malaga", None): "/pba_schema.html?day={date}"}
+    grid = client(base_url, paths).fetch_availability("PBA Malaga", "Hebat Court", BOOKING_DATE)
+
+    assert grid == app.parse_schema_grid(benchmark.load_schema_lanes())
+
+
+def test_unconfigured_courts_raise_not_configured(base_url):
+    with pytest.raises(app.PbaNotConfigured):
+        client(base_url).fetch_availability("PBA Malaga", None, BOOKING_DATE)
+
+
+def test_availability_route_reports_missing_configuration(monkeypatch):
+    monkeypatch.setattr(app, 'PBA_SCHEMA_PATHS', {})
+
+    response = app.app.test_client().get('/availability?week=2024-12-23&location=PBA%20Malaga')
+
+    assert response.status_code == 503
+    assert 'PBA_SCHEMA_PATHS' in response.get_json()['error']
+
+
+def test_fetch_credit_options_reads_the_credit_list_fixture(base_url):
+    options = client(base_url).fetch_credit_options()
+
+    prices = {option['price']: option['value'] for option in options if option['price'] is not None}
+    assert prices[13.0] == '103'
+    assert prices[100.0] == '109'
+    assert len(prices) == 9
+
+
+def test_fetch_credit_account_reads_the_balance(base_url):
+    options, balance = client(base_url).fetch_credit_account()
+
+    assert balance == 0.0
+    assert len(options) == 10
+
+
+def test_credit_balance_sums_the_credit_list_table():
+    html = ('<table class="creditList"><tr><th>Credit</th><th>Balance</th></tr>'
+            '<tr><td>Court credit</td><td>$1,024.50</td></tr><tr><td>Coaching</td><td>$ 12</td></tr></table>'
+            '<select class="paymentCreditSelect"></select>')
+
+    assert app.parse_credit_account(html) == ([], 1036.5)
+    assert app.parse_credit_account('<select class="paymentCreditSelect"></select>') == ([], None)
+
+
+def test_missing_pages_raise_pba_client_error(base_url):
+    with pytest.raises(app.PbaClientError):
+        client(base_url).get('/no-such-page.html')
@@ -0,0 +1,28 @@
+import json
+
+import app
+
+
+def test_step_log_rotates_past_its_size_cap(tmp_path):
+    path = str(tmp_path / 'steps.jsonl')
+    tracer = app.StepTracer(path, max_bytes=500, backups=2)
+
+    for index in range(60):
+        tracer.log({'step': 'navigation', 'index': index})
+
+    files = sorted(p.name for p in tmp_path.iterdir())
+    assert files == ['steps.jsonl', 'steps.jsonl.1', 'steps.jsonl.2']
+    assert all((tmp_path / name).stat().st_size < 500 + 200 for name in files)
+    with open(path, encoding='utf-8') as f:
+        assert json.loads(f.readlines()[-1])['index'] == 59
+
+
+def test_step_log_without_backups_starts_over(tmp_path):
+    path = str(tmp_path / 'steps.jsonl')
+    tracer = app.StepTracer(path, max_bytes=200, backups=0)
+
+    for index in range(20):
+        tracer.log({'step': 'navigation', 'index': index})
+
+    assert [p.name for p in tmp_path.iterdir()] == ['steps.jsonl']
+    assert (tmp_path / 'steps.jsonl').stat().st_size < 200
@@ -0,0 +1,86 @@
+import pytest
+
+import app
+
+WEEK = '2024-12-23'
+SESSIONS = [
+    {'studentName': 'Alice', 'dayOfWeek': 'Monday', 'courtLocation': 'PBA Malaga', 'courtType': '',
+     'sessionStart': '17:00', 'sessionEnd': '18:00'},
+    {'studentName': 'Bob', 'dayOfWeek': 'Wednesday', 'courtLocation': 'PBA Canningvale', 'courtType': 'Hebat Court',
+     'sessionStart': '18:00', 'sessionEnd': '19:30'},
+]
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    store = app.HistoryStore(str(tmp_path / 'history.db'))
+    store.write({'weekStarting': WEEK, 'sessions': [dict(session) for session in SESSIONS]})
+    monkeypatch.setattr(app, 'config_store', store)
+    return app.app.test_client()
+
+
+def template(**overrides):
+    return dict({'active': True, 'dayOfWeek': 'Wednesday', 'frequency': 'weekly', 'anchorWeek': '2025-01-06',
+                 'startDate': None, 'endDate': None, 'exceptions': []}, **overrides)
+
+
+def test_saving_a_week_twice_does_not_duplicate_templates(client):
+    first = client.post('/templates/from-week')
+    second = client.post('/templates/from-week')
+
+    assert first.status_code == 201 and len(first.get_json()['created']) == 2
+    assert second.status_code == 200 and second.get_json()['created'] == []
+    assert len(second.get_json()['skipped']) == 2
+    assert len(app.config_store.list_templates()) == 2
+
+    generated = client.post('/weeks/generate', json={'weekStarting': '2025-01-06'}).get_json()
+    assert generated[0]['sessions'] == 2
+
+
+def test_an_inactive_template_does_not_block_a_new_one(client):
+    client.post('/templates/from-week')
+    alice = next(t for t in app.config_store.list_templates() if t['studentName'] == 'Alice')
+    client.patch(f"/templates/{alice['id']}", json={'active': False})
+
+    created = client.post('/templates/from-week').get_json()['created']
+
+    assert [t['studentName'] for t in created] == ['Alice']
+
+
+def test_template_routes_reject_non_object_bodies(client):
+    assert client.post('/templates', json=['x']).status_code == 400
+    assert client.post('/terms', json=['x']).status_code == 400
+    assert client.post('/weeks/generate', json=['x']).status_code == 400
+
+
+def test_fortnightly_templates_follow_their_anchor_week():
+    fortnightly = template(frequency='fortnightly')
+
+    assert app.template_applies(fortnightly, '2025-01-06')
+    assert not app.template_applies(fortnightly, '2025-01-13')
+    assert app.template_applies(fortnightly, '2025-01-20')
+    assert app.template_applies(fortnightly, '2024-12-23')
+    assert not app.template_applies(fortnightly, '2024-12-30')
+
+
+def test_exceptions_skip_a_week_or_a_session_date():
+    assert not app.template_applies(template(exceptions=['2025-01-13']), '2025-01-13')
+    assert not app.template_applies(template(exceptions=['2025-01-15']), '2025-01-13')
+    assert app.template_applies(template(exceptions=['2025-01-14']), '2025-01-13')
+
+
+def test_template_and_term_bounds_use_the_session_date():
+    term = {'name': 'Term 1', 'startDate': '2025-02-03', 'endDate': '2025-04-11'}
+
+    # Wednesday sessions: the week of 2025-01-27 falls before the term, 2025-04-07 is its last week
+    assert not app.template_applies(template(), '2025-01-27', term)
+    assert app.template_applies(template(), '2025-02-03', term)
+    assert app.template_applies(template(), '2025-04-07', term)
+    assert not app.template_applies(template(), '2025-04-14', term)
+    assert not app.template_applies(template(startDate='2025-01-16'), '2025-01-13')
+    assert app.template_applies(template(startDate='2025-01-15'), '2025-01-13')
+    assert not app.template_applies(template(endDate='2025-01-14'), '2025-01-13')
+
+
+def test_inactive_templates_never_apply():
+    assert not app.template_applies(template(active=False), '2025-01-13')